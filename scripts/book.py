@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+书籍模式：把多个文档合并为一个带书签的 PDF
+- 每篇文档单独构建并缓存（沿用 pipeline 的 .tex 检查点），只有变化的章节需要重新编译
+- 章节不打印目录与页码；用 pdfpages 拼接各章 PDF，由书统一加页码
+- 各章的标题层级从其 .toc 读出，生成合并的可点击目录与嵌套书签，目录页码即书的页码
+- pdfpages 会丢弃被插入页面上的链接；安装了 pdfannotextractor 时用 pax 宏包把章节内的链接
+  （交叉引用与外部 URL）重新加入，否则章节正文中的链接不可点击
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import final_clickable_toc as toc
+import metrics
+from pipeline import CHECKPOINT_DIR, checkpoint_key, checkpoint_tex, doc_checkpoint_dir
+from toolchain import probe_toolchain
+
+# 章节缓存与 pipeline 的检查点分开（构建选项不同）
+BOOK_CHECKPOINT_DIR = os.path.join(CHECKPOINT_DIR, 'book')
+
+# 章节 header：页码由书统一加（\maketitle 用的 plain 样式也置空）；不打印目录，
+# 但仍写出 .toc（与 \tableofcontents 写文件的方式相同），供合并目录读取各标题的页码
+CHAPTER_HEADER = r"""
+% 书籍章节：不显示页码，写出 .toc 但不打印目录
+\pagestyle{empty}
+\makeatletter
+\let\ps@plain\ps@empty
+\AtBeginDocument{\if@filesw\newwrite\tf@toc\immediate\openout\tf@toc\jobname.toc\relax\fi}
+\makeatother
+"""
+
+CHAPTER_OPTIONS = {'draft': False, 'use_server': False, 'with_toc': False, 'extra_header': CHAPTER_HEADER}
+
+# .toc 中的层级 -> (report 类中的层级名, 层级数字)；文档本身作为 chapter
+TOC_LEVELS = {
+	'section': ('section', 1),
+	'subsection': ('subsection', 2),
+	'subsubsection': ('subsubsection', 3),
+}
+
+BOOK_TEMPLATE = r"""\documentclass{report}
+\usepackage{fontspec}
+\usepackage{xeCJK}
+\setmainfont{%(main_font)s}
+\setCJKmainfont{%(cjk_font)s}
+\usepackage{pdfpages}
+%(pax)s\usepackage[unicode=true]{hyperref}
+\usepackage{bookmark}
+\hypersetup{colorlinks=true,linkcolor=blue,linktoc=all,pdfencoding=auto,pdftitle={%(title)s}}
+\setcounter{tocdepth}{3}
+\renewcommand{\contentsname}{目录}
+\title{%(title)s}
+\author{}
+\date{}
+\begin{document}
+\maketitle
+\tableofcontents
+%(chapters)s
+\end{document}
+"""
+
+LATEX_SPECIALS = {
+	'\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#',
+	'_': r'\_', '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}',
+}
+
+
+def latex_escape(text: str) -> str:
+	return ''.join(LATEX_SPECIALS.get(ch, ch) for ch in text)
+
+
+def _group(text: str, i: int) -> Tuple[str, int]:
+	"""读取 text[i] 处起的一个 {...} 分组（支持嵌套），返回内容与分组结束后的位置"""
+	while text[i] != '{':
+		i += 1
+	depth = 0
+	for j in range(i, len(text)):
+		if text[j] == '{':
+			depth += 1
+		elif text[j] == '}':
+			depth -= 1
+			if depth == 0:
+				return text[i + 1:j], j + 1
+	raise ValueError('花括号不匹配')
+
+
+def read_toc(toc_path: str) -> List[Tuple[str, str, int]]:
+	"""从各章的 .toc 读出 (层级, 标题 LaTeX, 页码)"""
+	entries = []
+	if not os.path.exists(toc_path):
+		return entries
+	with open(toc_path, 'r', encoding='utf-8', errors='replace') as f:
+		for line in f:
+			start = line.find(r'\contentsline')
+			if start < 0:
+				continue
+			try:
+				level, i = _group(line, start)
+				heading, i = _group(line, i)
+				page, i = _group(line, i)
+			except (ValueError, IndexError):
+				continue
+			if level not in TOC_LEVELS or not page.strip().isdigit():
+				continue
+			# 去掉编号：\numberline {1.2}
+			if heading.startswith(r'\numberline'):
+				_, k = _group(heading, 0)
+				heading = heading[k:].strip()
+			entries.append((level, heading, int(page)))
+	return entries
+
+
+def extract_links(pdf_path: str) -> bool:
+	"""用 pdfannotextractor 把章节 PDF 的链接导出为同名 .pax（供 pax 宏包重新加入）；返回是否成功"""
+	if not probe_toolchain()['features'].get('pdfannotextractor'):
+		return False
+	res = subprocess.run(['pdfannotextractor', pdf_path], capture_output=True, text=True)
+	if res.returncode != 0:
+		print(f"⚠️ 章节链接提取失败，该章正文链接不可点击: {pdf_path}\n{res.stderr}")
+		return False
+	return True
+
+
+def build_chapter(md_path: str, checkpoint_dir: str) -> Tuple[str, str]:
+	"""构建（或复用）单章 PDF，返回 (PDF 路径, .toc 路径)；源文件、选项、预处理规则与工具链未变化时不重新编译"""
+	options = CHAPTER_OPTIONS
+	doc_dir = doc_checkpoint_dir(md_path, checkpoint_dir)
+	pdf_path = str(doc_dir / 'document.pdf')
+	meta_path = doc_dir / 'chapter.json'
+	key = checkpoint_key(md_path, options)
+	if os.path.exists(pdf_path) and meta_path.exists():
+		with open(meta_path, 'r', encoding='utf-8') as f:
+			if json.load(f).get('key') == key:
+				metrics.inc('md2pdf_cache_requests_total', cache='chapter', result='hit')
+				print(f"✅ 章节未变化，复用: {md_path}")
+				return pdf_path, str(doc_dir / 'document.toc')
+	metrics.inc('md2pdf_cache_requests_total', cache='chapter', result='miss')
+	tex_path = checkpoint_tex(md_path, options, checkpoint_dir)
+	# 旧的链接文件对应旧的 PDF，重新编译前删除
+	Path(pdf_path).with_suffix('.pax').unlink(missing_ok=True)
+	res = toc.latex_to_pdf(tex_path, pdf_path)
+	toc.record_result(res, pdf_path)
+	if res.returncode != 0:
+		raise RuntimeError(f"章节编译失败: {md_path}\n" + (res.stderr or res.stdout[-3000:]))
+	extract_links(pdf_path)
+	with open(meta_path, 'w', encoding='utf-8') as f:
+		json.dump({'key': key}, f)
+	print(f"✅ 章节已重新构建: {md_path}")
+	return pdf_path, str(doc_dir / 'document.toc')
+
+
+def chapter_latex(index: int, md_path: str, pdf_path: str, toc_path: str) -> str:
+	"""一章的 \\includepdf：文档标题作为 chapter，其标题树按原层级加入目录与书签；每页加上书的页码"""
+	with open(md_path, 'r', encoding='utf-8') as f:
+		title = latex_escape(toc.extract_title_from_markdown(f.read()))
+	entries = [f'1,chapter,0,{{{title}}},book{index}']
+	for n, (level, heading, page) in enumerate(read_toc(toc_path)):
+		name, depth = TOC_LEVELS[level]
+		entries.append(f'{page},{name},{depth},{{{heading}}},book{index}.{n}')
+	pdf = Path(pdf_path).resolve().as_posix()
+	return ('\\includepdf[pages=-,pagecommand={\\thispagestyle{plain}},addtotoc={%\n  '
+	        + ',\n  '.join(entries) + '}]{' + pdf + '}')
+
+
+def build_book(md_paths: List[str], out_path: str, title: Optional[str] = None,
+               checkpoint_dir: str = BOOK_CHECKPOINT_DIR, jobs: Optional[int] = None) -> bool:
+	"""合并多个文档为一本 PDF；只重新构建有变化的章节"""
+	try:
+		with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+			chapters = list(pool.map(lambda md: build_chapter(md, checkpoint_dir), md_paths))
+	except RuntimeError as e:
+		print(f"❌ {e}")
+		return False
+
+	if title is None:
+		title = Path(out_path).stem
+	body = '\n'.join(chapter_latex(i, md, pdf, toc_file)
+	                 for i, (md, (pdf, toc_file)) in enumerate(zip(md_paths, chapters)))
+	# 有章节链接文件（.pax）时由 pax 在插入页面时重新加入链接
+	with_links = any(Path(pdf).with_suffix('.pax').exists() for pdf, _ in chapters)
+	work_dir = tempfile.mkdtemp(prefix='md2pdf_book_')
+	try:
+		tex_path = os.path.join(work_dir, 'book.tex')
+		with open(tex_path, 'w', encoding='utf-8') as f:
+			f.write(BOOK_TEMPLATE % {
+				'main_font': toc.MAIN_FONT,
+				'cjk_font': toc.CJK_FONT,
+				'title': latex_escape(title),
+				'pax': '\\usepackage{pax}\n' if with_links else '',
+				'chapters': body,
+			})
+		# 合并目录需要多遍编译才能稳定
+		res = toc.latex_to_pdf(tex_path, out_path)
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+	toc.record_result(res, out_path)
+	if res.returncode != 0:
+		print("❌ 合并失败:\n" + (res.stderr or res.stdout[-3000:]))
+		return False
+	print(f"✅ 成功合并 {len(md_paths)} 篇文档 -> {out_path}")
+	return True
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description='把多个 Markdown 文档合并为一本带书签的 PDF')
+	parser.add_argument('md', nargs='+', help='各章 Markdown 文件（按顺序）')
+	parser.add_argument('-o', '--output', required=True, help='输出 PDF 路径')
+	parser.add_argument('--title', help='书名（默认取输出文件名）')
+	parser.add_argument('--checkpoint-dir', default=BOOK_CHECKPOINT_DIR, help='各章缓存目录')
+	parser.add_argument('-j', '--jobs', type=int, help='并行构建章节数（默认 CPU 核数）')
+	parser.add_argument('--metrics-file', help='结束时把运行指标写入该文件（Prometheus 文本格式）')
+	args = parser.parse_args()
+
+	missing = [md for md in args.md if not os.path.exists(md)]
+	for md in missing:
+		print(f"❌ 文件不存在: {md}")
+	if missing:
+		return
+	Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+	ok = build_book(args.md, args.output, args.title, args.checkpoint_dir, args.jobs)
+	if args.metrics_file:
+		metrics.write_textfile(args.metrics_file)
+	print('🎉 完成' if ok else '❌ 合并失败')
+
+if __name__ == '__main__':
+	main()
@@ -9,9 +9,72 @@
 """
 
 import os
+import shutil
 import subprocess
+import multiprocessing
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Dict, FrozenSet, List, Optional
+
+import metrics
+import pandoc_server
+from preamble import ALL_FEATURES, compose_preamble, detect_features
+from toolchain import missing_binaries, probe_toolchain
+
+# 正文字体（西文 / 中文）
+MAIN_FONT = 'Times New Roman'
+CJK_FONT = 'STSong'
+
+# 超长代码块/表格的拆分阈值（行数）；约 50 行代码或 40 行表格为一页
+CODE_BLOCK_MAX_LINES = 200
+CODE_CHUNK_LINES = 50
+FAST_VERBATIM_LINES = 1000
+TABLE_MAX_ROWS = 200
+TABLE_CHUNK_ROWS = 40
+
+# 超过该大小的 .tex 按比例放大 TeX 内存参数；xelatex 每遍超时 = 基础 + 每 MB 增量（秒）
+LARGE_TEX_BYTES = 1 << 20
+LATEX_BASE_TIMEOUT = 300
+LATEX_TIMEOUT_PER_MB = 120
+
+# 预处理规则的版本；修改 preprocess_markdown / split_oversized_blocks 等改写规则时递增，使 .tex 检查点失效
+PREPROCESS_VERSION = 3
+
+# 超过该大小（UTF-8 字节数）的文档按一级标题分段、多进程并行预处理；
+# 每段至少这么多字符，避免进程间传输开销占主导
+PARALLEL_PREPROCESS_BYTES = 512 * 1024
+PREPROCESS_CHUNK_CHARS = 128 * 1024
+
+# 草稿预览 header：只保留中文换行与段落/列表间距，去掉重复的宽松排版设置
+DRAFT_HEADER = r"""
+% 中文（配合 xelatex）
+\usepackage{xeCJK}
+\XeTeXlinebreaklocale "zh"
+\XeTeXlinebreakskip = 0pt plus 2pt
+
+% 一次性的宽松排版设置，避免 tolerance=100000 带来的断行搜索开销
+\raggedright
+\emergencystretch=3em
+\hbadness=10000
+% draft 类选项会给溢出行画黑条，预览时关闭
+\setlength{\overfullrule}{0pt}
+
+% 段落与行距
+\setlength{\parskip}{0.8em}
+\setlength{\parindent}{1.2em}
+
+% 列表间距（与正式版一致，保证版面接近）
+\renewcommand{\tightlist}{%
+  \setlength{\itemsep}{1.0em}%
+  \setlength{\parskip}{0.5em}%
+  \setlength{\parsep}{0.5em}%
+  \setlength{\topsep}{0.5em}%
+  \setlength{\partopsep}{0.2em}%
+}
+"""
+
 
 def extract_title_from_markdown(content: str) -> str:
 	"""从Markdown内容中提取标题"""
@@ -30,20 +93,112 @@ def extract_title_from_markdown(content: str) -> str:
 	
 	return "文档"
 
-def build(md_path: str, out_path: Optional[str] = None) -> bool:
-	if out_path is None:
-		out_dir = Path('../pdf_docs')
-		out_dir.mkdir(exist_ok=True)
-		out_path = str(out_dir / f"{Path(md_path).stem}_final_clickable_clean.pdf")
-	
-	# 预处理Markdown文件，确保列表格式正确
-	with open(md_path, 'r', encoding='utf-8') as f:
-		content = f.read()
-	
-	# 提取文档标题
-	doc_title = extract_title_from_markdown(content)
-	
-	# 优化Markdown格式，保持原有结构
+# Markdown 图片引用：![alt](path "title")
+IMAGE_PATTERN = r'!\[[^\]]*\]\(\s*<?([^)\s>]+)>?'
+# 行内代码：开头与结尾的反引号个数相同
+INLINE_CODE_PATTERN = r'(?<!`)(`+)(?!`)[\s\S]*?(?<!`)\1(?!`)'
+# 围栏代码块：``` 或 ~~~（至少 3 个，可缩进，如嵌在列表中）；只有同种字符、不短于开头的围栏才能闭合
+FENCE_PATTERN = r'^(\s*)(`{3,}|~{3,})(.*)$'
+
+def _opening_fence(line: str):
+	"""围栏代码块的开头行，返回 (缩进, 围栏, 语言标记) 的匹配；反引号围栏的语言标记中不能有反引号"""
+	import re
+	opening = re.match(FENCE_PATTERN, line)
+	if opening and not (opening.group(2)[0] == '`' and '`' in opening.group(3)):
+		return opening
+	return None
+
+def _closing_fence(marker: str):
+	import re
+	return re.compile(rf'^\s*{re.escape(marker[0])}{{{len(marker)},}}\s*$')
+
+def _map_outside_code(content: str, func) -> str:
+	"""对代码块（围栏代码块与缩进代码块）之外的各段文本调用 func，代码块原样保留"""
+	import re
+	lines = content.split('\n')
+	segments = []
+	text = []
+	def flush():
+		if text:
+			segments.append(func('\n'.join(text)))
+			text.clear()
+	prev_blank = True
+	in_list = False
+	i = 0
+	while i < len(lines):
+		line = lines[i]
+		opening = _opening_fence(line)
+		if opening:
+			closing_fence = _closing_fence(opening.group(2))
+			j = i + 1
+			while j < len(lines) and not closing_fence.match(lines[j]):
+				j += 1
+			# 未闭合的围栏一直到文末都是代码
+			j = min(j + 1, len(lines))
+		elif prev_blank and not in_list and line.strip() and re.match(r'( {4}|\t)', line):
+			# 缩进代码块（列表中的缩进行视为列表内容）
+			j = i + 1
+			while j < len(lines) and (not lines[j].strip() or re.match(r'( {4}|\t)', lines[j])):
+				j += 1
+		else:
+			text.append(line)
+			if re.match(r'\s*([-*+]|\d+[.)])\s', line):
+				in_list = True
+			elif line.strip() and not line[0].isspace():
+				in_list = False
+			prev_blank = not line.strip()
+			i += 1
+			continue
+		flush()
+		segments.append('\n'.join(lines[i:j]))
+		prev_blank = not lines[j - 1].strip()
+		i = j
+	flush()
+	return '\n'.join(segments)
+
+def image_references(content: str) -> List[str]:
+	"""代码（代码块与行内代码）之外的图片引用路径"""
+	import re
+	refs = []
+	def collect(text):
+		for match in re.finditer(INLINE_CODE_PATTERN + '|' + IMAGE_PATTERN, text):
+			if match.group(1) is None:
+				refs.append(match.group(2))
+		return text
+	_map_outside_code(content, collect)
+	return refs
+
+def local_image_path(ref: str, base_dir: str) -> Optional[str]:
+	"""本地图片引用对应的绝对路径（相对 base_dir）；URL 返回 None"""
+	import re
+	if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', ref):
+		return None
+	return str(Path(base_dir).resolve() / ref)
+
+def resolve_image_paths(content: str, base_dir: str) -> str:
+	"""把代码（代码块与行内代码）之外的本地图片引用改写为绝对路径，pandoc/xelatex 不再依赖当前工作目录"""
+	import re
+	def replace(match):
+		text = match.group(0)
+		if match.group(1) is not None:
+			return text
+		path = local_image_path(match.group(2), base_dir)
+		if path is None:
+			return text
+		start, end = match.start(2) - match.start(), match.end(2) - match.start()
+		if ' ' in path and '<' not in text[:start]:
+			path = f'<{path}>'
+		return text[:start] + path + text[end:]
+	return _map_outside_code(content, lambda text: re.sub(INLINE_CODE_PATTERN + '|' + IMAGE_PATTERN, replace, text))
+
+def preprocess_markdown(content: str) -> str:
+	"""优化Markdown格式，保持原有结构（代码块保护、段落/列表间距、定义块缩进、公式换行）"""
+	content = _preprocess_spacing(content)
+	content = _mark_ascii_art(content)
+	return _preprocess_formatting(content)
+
+def _preprocess_spacing(content: str) -> str:
+	"""预处理第一部分：保护代码块，改善标题、列表与段落间距（只看相邻行，可分段执行）"""
 	import re
 	
 	# 1. 保护代码块不被修改
@@ -99,19 +254,26 @@ def build(md_path: str, out_path: Optional[str] = None) -> bool:
 	
 	content = '\n'.join(processed_lines)
 	
-	# 4. 改善ASCII图表显示
-	# 为ASCII图表添加特殊标记
-	ascii_art_pattern = r'```\n([\s\S]*?[┌┐└┘│─├┤┬┴┼]+[\s\S]*?)\n```'
+	# 恢复代码块
+	for i, code_block in enumerate(code_blocks):
+		content = content.replace(f"__CODE_BLOCK_{i}__", code_block)
+	return content
+
+# 4. 改善ASCII图表显示：为ASCII图表添加特殊标记
+# 该模式可能从一个代码块的结束标记一直匹配到后面章节的图表，只能对整篇执行
+ASCII_ART_PATTERN = r'```\n([\s\S]*?[┌┐└┘│─├┤┬┴┼]+[\s\S]*?)\n```'
+
+def _mark_ascii_art(content: str) -> str:
+	"""预处理第二部分：处理ASCII艺术（整篇执行）"""
+	import re
 	def enhance_ascii_art(match):
 		content = match.group(1)
 		return f'```{{.ascii}}\n{content}\n```'
-	
-	# 先恢复代码块
-	for i, code_block in enumerate(code_blocks):
-		content = content.replace(f"__CODE_BLOCK_{i}__", code_block)
-	
-	# 然后处理ASCII艺术
-	content = re.sub(ascii_art_pattern, enhance_ascii_art, content)
+	return re.sub(ASCII_ART_PATTERN, enhance_ascii_art, content)
+
+def _preprocess_formatting(content: str) -> str:
+	"""预处理第三部分：引用/标题格式、代码块语言标记、定义块缩进、公式换行（可分段执行）"""
+	import re
 	
 	# 5. 改善markdown文本格式，让PDF更接近原始文档
 	# 确保重要的格式标记得到保留
@@ -219,332 +381,527 @@ def build(md_path: str, out_path: Optional[str] = None) -> bool:
 	content = re.sub(r'(性能得分 = 响应速度得分 × 0\.6 \+ 稳定性得分 × 0\.4)', r'      性能得分 = 响应速度得分 × 0.6 + 稳定性得分 × 0.4', content)
 	content = re.sub(r'(价格得分 = 100 - 价格排名百分比)', r'    价格得分 = 100 - 价格排名百分比', content)
 	
-	# 创建临时处理后的文件
-	temp_md = 'temp_processed.md'
-	with open(temp_md, 'w', encoding='utf-8') as f:
-		f.write(content)
-	
-	# 使用处理后的文件进行转换
-	md_path = temp_md
-
-	# header-includes：超链接+中文+行距/段落/列表间距优化
-	header = r"""
-% 中文与字体（配合 xelatex）
-\usepackage{xeCJK}
-\usepackage{fontspec}
-% 中文自动换行设置
-\XeTeXlinebreaklocale "zh"
-\XeTeXlinebreakskip = 0pt plus 2pt
-\sloppy
-\emergencystretch=15em
-\pretolerance=10000
-\tolerance=20000
-\hbadness=10000
-
-% URL 自动换行
-\usepackage{xurl}
-\urlstyle{same}
-
-
-
-% 防止文本截断的额外设置
-\raggedright
-\setlength{\emergencystretch}{25em}
-\setlength{\tolerance}{100000}
-\setlength{\pretolerance}{30000}
-\setlength{\hbadness}{10000}
-
-% 强制文本换行设置
-\sloppy
-\emergencystretch=25em
-\pretolerance=30000
-\tolerance=100000
-\hbadness=10000
-
-% 额外的文本截断防护
-\sloppy
-\emergencystretch=8em
-\pretolerance=2000
-\tolerance=5000
-\hbadness=10000
-
-% 强制文本换行设置
-\setlength{\emergencystretch}{10em}
-\setlength{\tolerance}{10000}
-\setlength{\pretolerance}{5000}
-\setlength{\hbadness}{10000}
-
-% 全局宽松排版
-\sloppy
-\emergencystretch=10em
-\pretolerance=5000
-\tolerance=10000
-\hbadness=10000
-
-% 全局文本处理设置
-\AtBeginDocument{%
-  \sloppy
-  \emergencystretch=25em
-  \pretolerance=30000
-  \tolerance=100000
-  \hbadness=10000
-  \setlength{\emergencystretch}{25em}
-  \setlength{\tolerance}{100000}
-  \setlength{\pretolerance}{30000}
-  \setlength{\hbadness}{10000}
-}
-
-% 改进的代码块和缩进设置
-\usepackage{fancyvrb}
-\usepackage{xcolor}
-\definecolor{codebg}{RGB}{248,248,248}
-\definecolor{codeframe}{RGB}{220,220,220}
-
-% 主要代码块环境 - 更好的缩进
-\DefineVerbatimEnvironment{Highlighting}{Verbatim}{%
-  fontsize=\small,
-  baselinestretch=1.1,
-  frame=leftline,
-  framerule=2pt,
-  framesep=0.8em,
-  xleftmargin=2.5em,
-  rulecolor=\color{codeframe},
-  commandchars=\\\{\}
-}
-
-% JSON和API代码的特殊环境
-\DefineVerbatimEnvironment{CodeBlock}{Verbatim}{%
-  fontfamily=tt,
-  fontsize=\footnotesize,
-  baselinestretch=1.05,
-  frame=single,
-  framerule=0.4pt,
-  framesep=1.2em,
-  xleftmargin=2em,
-  xrightmargin=1em,
-  rulecolor=\color{codeframe}
-}
-
-% 通用代码块
-\DefineVerbatimEnvironment{Verbatim}{Verbatim}{%
-  fontsize=\small,
-  frame=single,
-  commandchars=\\\{\},
-  xleftmargin=2em,
-  xrightmargin=1em
-}
-
-% 定义列表和段落格式改进
-\usepackage{enumitem}
-
-% 定义描述环境 - 用于功能描述等
-\newenvironment{definitiondesc}{%
-  \begin{list}{}{%
-    \setlength{\leftmargin}{2em}%
-    \setlength{\rightmargin}{0em}%
-    \setlength{\itemindent}{0em}%
-    \setlength{\parsep}{0.3em}%
-    \setlength{\itemsep}{0.2em}%
-  }%
-  \item[]%
-}{%
-  \end{list}%
-}
-
-% 改进的列表间距
-\setlist[itemize]{
-  leftmargin=2.5em,
-  itemsep=0.4em,
-  parsep=0.2em,
-  topsep=0.5em
-}
-
-\setlist[enumerate]{
-  leftmargin=2.5em,
-  itemsep=0.4em,
-  parsep=0.2em,
-  topsep=0.5em
-}
-
-% 嵌套列表的特殊处理
-\setlist[itemize,2]{
-  leftmargin=2em,
-  itemsep=0.3em
-}
-
-% 段落缩进控制
-\setlength{\parindent}{0pt}
-\setlength{\parskip}{0.8em}
-
-% 行内代码的改进样式
-\let\oldtexttt\texttt
-\renewcommand{\texttt}[1]{%
-  \colorbox{codebg}{%
-    \footnotesize\oldtexttt{\hspace{0.2em}#1\hspace{0.2em}}%
-  }%
-}
-
-% 改进标题间距
-\usepackage{titlesec}
-\titlespacing*{\section}{0pt}{*3.5}{*2.5}
-\titlespacing*{\subsection}{0pt}{*3}{*2}  
-\titlespacing*{\subsubsection}{0pt}{*2.5}{*1.5}
-\titlespacing*{\paragraph}{0pt}{*2}{*1}
-
-% 长公式处理
-\newcommand{\longformula}[1]{\sloppypar\noindent\texttt{#1}\par}
-
-% 强制长文本换行
-\newcommand{\forcebreak}[1]{%
-  \sloppy
-  \emergencystretch=20em
-  \pretolerance=20000
-  \tolerance=50000
-  \hbadness=10000
-  #1
-}
-
-% 专门处理长公式的环境
-\newenvironment{longformulaenv}{%
-  \sloppypar
-  \emergencystretch=25em
-  \pretolerance=30000
-  \tolerance=100000
-  \hbadness=10000
-  \setlength{\emergencystretch}{25em}
-  \setlength{\tolerance}{100000}
-  \setlength{\pretolerance}{30000}
-  \setlength{\hbadness}{10000}
-}{}
+	return content
 
+# 各阶段中可能跨行匹配的模式；分段位置不能落在这些匹配范围内
+SPACING_SPAN_PATTERNS = (r'```[\s\S]*?```',)
+FORMATTING_SPAN_PATTERNS = (r'```http\n([\s\S]*?)\n```', r'```json\n([\s\S]*?)\n```')
 
-
-
-
-% 超链接/书签配置
-\usepackage[unicode=true]{hyperref}
-\hypersetup{
-  colorlinks=true,
-  linkcolor=blue,
-  urlcolor=blue,
-  citecolor=blue,
-  linktoc=all,
-  pdfencoding=auto
-}
-% 避免重复锚点导致跳回目录
-\makeatletter
-\@ifpackageloaded{hyperref}{\hypersetup{hypertexnames=false}}{}
-\makeatother
-
-% 目录标题本地化
-\renewcommand{\contentsname}{目录}
-
-% 处理标题中的特殊字符
-\makeatletter
-\def\@maketitle{%
-  \newpage
-  \null
-  \vskip 2em%
-  \begin{center}%
-  \let \footnote \thanks
-    {\LARGE \@title \par}%
-    \vskip 1.5em%
-    {\large \lineskip .5em%
-      \begin{tabular}[t]{c}%
-        \@author
-      \end{tabular}\par}%
-    \vskip 1em%
-    {\large \@date}%
-  \end{center}%
-  \par
-  \vskip 1.5em}
-\makeatother
-
-% 段落与行距 - 确保与原始Markdown格式一致
-\setlength{\parskip}{0.8em}
-\setlength{\parindent}{1.2em}
-\linespread{1.2}
-
-% 列表间距优化 - 确保与原始Markdown格式一致
-\usepackage{enumitem}
-\setlist[itemize]{leftmargin=2em,itemsep=1.0em,parsep=0.5em,topsep=0.5em,partopsep=0.2em}
-\setlist[enumerate]{leftmargin=2em,itemsep=1.0em,parsep=0.5em,topsep=0.5em,partopsep=0.2em}
-
-% 强制每个列表项单独成行，禁用紧凑模式
-\renewcommand{\tightlist}{%
-  \setlength{\itemsep}{1.0em}%
-  \setlength{\parskip}{0.5em}%
-  \setlength{\parsep}{0.5em}%
-  \setlength{\topsep}{0.5em}%
-  \setlength{\partopsep}{0.2em}%
-}
-"""
-	header_file = 'pandoc_hyperref_setup.tex'
-	with open(header_file, 'w', encoding='utf-8') as f:
-		f.write(header)
-
-	cmd = [
-		'pandoc', md_path,
-		'--pdf-engine=xelatex',
-		'--toc',
+def _after_bare_heading(content: str, pos: int) -> bool:
+	"""pos 之前最近的非空行是否为空标题（如 "#"）；标题间距规则中的 \\s+ 会越过其后的空行"""
+	import re
+	end = pos
+	while end > 0 and content[end - 1].isspace():
+		end -= 1
+	line = content[content.rfind('\n', 0, end) + 1:end]
+	return re.fullmatch(r'#{1,6}', line) is not None
+
+def _safe_split_points(content: str, span_patterns) -> List[int]:
+	"""可安全分段的位置：一级标题的行首，前一行为空，不紧跟空标题，且不在 span_patterns 的任何匹配范围内"""
+	import re
+	spans = sorted(m.span() for pattern in span_patterns for m in re.finditer(pattern, content))
+	points = []
+	k = 0
+	covered = 0
+	for m in re.finditer(r'\n\n(?=# )', content):
+		pos = m.end()
+		while k < len(spans) and spans[k][0] < pos:
+			covered = max(covered, spans[k][1])
+			k += 1
+		if covered <= pos and not _after_bare_heading(content, pos):
+			points.append(pos)
+	return points
+
+def _map_chunks(pool: ProcessPoolExecutor, func, content: str, span_patterns, chunk_size: int) -> str:
+	"""在安全位置把 content 分成不小于 chunk_size 的段，用进程池执行 func 后拼接"""
+	chunks = []
+	start = 0
+	for pos in _safe_split_points(content, span_patterns):
+		if pos - start >= chunk_size:
+			# 段末的空行保留为该段最后一行（去掉换行符），拼接时补回
+			chunks.append(content[start:pos - 1])
+			start = pos
+	chunks.append(content[start:])
+	return '\n'.join(pool.map(func, chunks))
+
+_preprocess_pool: Optional[ProcessPoolExecutor] = None
+_preprocess_pool_lock = threading.Lock()
+
+def get_preprocess_pool() -> ProcessPoolExecutor:
+	"""进程内共享的预处理进程池（首次使用时创建）；批量转换的各线程共用，进程总数不超过 CPU 核数
+	池在多线程环境中创建，用 spawn 启动子进程，避免 fork 复制其它线程持有的锁"""
+	global _preprocess_pool
+	with _preprocess_pool_lock:
+		if _preprocess_pool is None:
+			_preprocess_pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+			                                       mp_context=multiprocessing.get_context('spawn'))
+		return _preprocess_pool
+
+def _preprocess_chunked(content: str, chunk_size: int = PREPROCESS_CHUNK_CHARS) -> str:
+	pool = get_preprocess_pool()
+	content = _map_chunks(pool, _preprocess_spacing, content, SPACING_SPAN_PATTERNS, chunk_size)
+	content = _mark_ascii_art(content)
+	return _map_chunks(pool, _preprocess_formatting, content, FORMATTING_SPAN_PATTERNS, chunk_size)
+
+def preprocess_markdown_parallel(content: str) -> str:
+	"""大文档按一级标题分段，在共享进程池中并行预处理后拼接；结果与 preprocess_markdown 逐字节一致"""
+	if len(content.encode('utf-8')) < PARALLEL_PREPROCESS_BYTES:
+		return preprocess_markdown(content)
+	return _preprocess_chunked(content)
+
+def _split_code_block(fence: str, info: str, body: List[str]) -> List[str]:
+	"""超长代码块按页拆分（沿用原围栏的缩进与标记）；特别长的去掉语言标记，走不带高亮的 verbatim 快速路径"""
+	if len(body) > FAST_VERBATIM_LINES:
+		info = ''
+	out = []
+	for start in range(0, len(body), CODE_CHUNK_LINES):
+		if out:
+			out.append('')
+		out += [fence + info, *body[start:start + CODE_CHUNK_LINES], fence]
+	return out
+
+def _split_table(header: str, separator: str, rows: List[str]) -> List[str]:
+	"""超长管道表格按行数拆成多张表，每张重复表头"""
+	if len(rows) <= TABLE_MAX_ROWS:
+		return [header, separator, *rows]
+	out = []
+	for start in range(0, len(rows), TABLE_CHUNK_ROWS):
+		if out:
+			out.append('')
+		out += [header, separator, *rows[start:start + TABLE_CHUNK_ROWS]]
+	return out
+
+def split_oversized_blocks(content: str) -> str:
+	"""把超长代码块与表格拆成按页大小的若干块，避免 TeX 内存溢出与分页过慢"""
+	import re
+	table_separator = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+	lines = content.split('\n')
+	out = []
+	i = 0
+	while i < len(lines):
+		line = lines[i]
+		opening = _opening_fence(line)
+		if opening:
+			indent, marker, info = opening.groups()
+			closing_fence = _closing_fence(marker)
+			j = i + 1
+			while j < len(lines) and not closing_fence.match(lines[j]):
+				j += 1
+			if j >= len(lines):
+				# 未闭合的代码块保持原样
+				out += lines[i:]
+				break
+			body = lines[i + 1:j]
+			if len(body) <= CODE_BLOCK_MAX_LINES:
+				out += lines[i:j + 1]
+			else:
+				out += _split_code_block(indent + marker, info, body)
+			i = j + 1
+			continue
+		if line.lstrip().startswith('|') and i + 1 < len(lines) and table_separator.match(lines[i + 1]):
+			j = i + 2
+			while j < len(lines) and lines[j].lstrip().startswith('|'):
+				j += 1
+			out += _split_table(line, lines[i + 1], lines[i + 2:j])
+			i = j
+			continue
+		out.append(line)
+		i += 1
+	return '\n'.join(out)
+
+def pandoc_latex_options(doc_title: str, draft: bool = False, with_toc: bool = True) -> dict:
+	"""Markdown -> LaTeX 的 pandoc 选项；命令行与 pandoc server 共用，保证两条路径输出一致"""
+	if draft:
+		variables = {
+			'CJKmainfont': CJK_FONT,
+			'geometry': 'margin=2.5cm',
+			'fontsize': '10pt',
+			'linestretch': '1.2',
+			# graphicx/hyperref 的 draft 选项：图片只画占位框（保留尺寸），不生成链接
+			'classoption': 'draft',
+		}
+	else:
+		variables = {
+			'mainfont': MAIN_FONT,
+			'CJKmainfont': CJK_FONT,
+			'geometry': 'margin=2.5cm',
+			'fontsize': '10pt',
+			'toc-depth': '3',
+			'toc-title': '目录',
+			# 段落/列表/断行设置统一由 header 给出，这里只保留模板识别的变量
+			'linestretch': '1.2',
+		}
+	return {
+		'toc': with_toc and not draft,
+		'variables': variables,
+		# 不显示作者/日期
+		'metadata': {'title': doc_title, 'author': '', 'date': ''},
+	}
+
+def pandoc_latex_cmd(md_path: str, tex_path: str, header_file: str, doc_title: str, draft: bool = False,
+                     input_format: Optional[str] = None, with_toc: bool = True) -> List[str]:
+	"""生成 Markdown -> LaTeX 的 pandoc 命令；草稿模式不生成目录、不加载正文西文字体"""
+	options = pandoc_latex_options(doc_title, draft, with_toc)
+	cmd = ['pandoc', md_path]
+	if input_format:
+		cmd += ['-f', input_format]
+	cmd += [
+		'--standalone',
 		'--wrap=none',
-		'-V', 'mainfont=Times New Roman',
-		'-V', 'CJKmainfont=STSong',
-		'-V', 'geometry:margin=2.5cm',
-		'-V', 'fontsize=10pt',
-		'-V', 'toc-depth=3',
-		'-V', 'toc-title=目录',
-		'-V', 'linestretch=1.2',
-		'-V', 'parskip=0.8em',
-		'-V', 'parindent=1.2em',
-		'-V', 'itemsep=1.0em',
-		'-V', 'emergencystretch=25em',
-		'-V', 'tolerance=100000',
-		'-V', 'pretolerance=30000',
-		'-V', 'parsep=0.5em',
-		'-V', 'topsep=0.5em',
-		'-V', 'partopsep=0.2em',
-		'--metadata', f'title={doc_title}',
-		'--metadata', 'author=',  # 空
-		'--metadata', 'date=',    # 空
+		'-t', 'latex',
+	]
+	if options['toc']:
+		cmd.append('--toc')
+	for key, value in options['variables'].items():
+		cmd += ['-V', f'{key}={value}']
+	for key, value in options['metadata'].items():
+		cmd += ['--metadata', f'{key}={value}']
+	cmd += [
 		'-H', header_file,
-		'-o', out_path,
+		'-o', tex_path,
+	]
+	return cmd
+
+def latex_job_env(tex_path: str) -> Dict[str, str]:
+	"""按 .tex 大小为本次 xelatex 设定 TeX 内存参数（通过 kpathsea 环境变量覆盖 texmf.cnf）"""
+	env = dict(os.environ)
+	size = os.path.getsize(tex_path)
+	with open(tex_path, 'r', encoding='utf-8', errors='replace') as f:
+		longest = max((len(line) for line in f), default=0)
+	params = {
+		# 单行输入缓冲需容纳最长的一行（超长 JSON 行常见）
+		'buf_size': max(200000, longest * 4),
+	}
+	if size > LARGE_TEX_BYTES:
+		scale = size // LARGE_TEX_BYTES
+		params.update({
+			'extra_mem_top': min(5000000 * scale, 50000000),
+			'extra_mem_bot': min(5000000 * scale, 50000000),
+			'pool_size': min(6250000 * (scale + 1), 40000000),
+			'save_size': min(100000 * (scale + 1), 1000000),
+			'stack_size': min(10000 * (scale + 1), 100000),
+		})
+	for key, value in params.items():
+		# 用户显式设置的值优先
+		env.setdefault(key, str(value))
+	return env
+
+def compile_latex(tex_path: str, out_path: str, max_passes: int = 3) -> subprocess.CompletedProcess:
+	"""用 xelatex 编译 .tex；目录/书签未稳定时重复编译（与 pandoc 相同，最多 max_passes 遍）"""
+	work_dir = os.path.dirname(os.path.abspath(tex_path))
+	stem = Path(tex_path).stem
+	toc_file = os.path.join(work_dir, f'{stem}.toc')
+	cmd = [
+		'xelatex',
+		'-interaction=nonstopmode',
+		'-halt-on-error',
+		f'-output-directory={work_dir}',
+		tex_path,
 	]
-	res = subprocess.run(cmd, capture_output=True, text=True)
+	env = latex_job_env(tex_path)
+	# 每遍的超时按文档大小估算，避免异常文档无限占用
+	timeout = LATEX_BASE_TIMEOUT + LATEX_TIMEOUT_PER_MB * os.path.getsize(tex_path) // (1 << 20)
+	prev_toc = None
+	for _ in range(max_passes):
+		try:
+			res = subprocess.run(cmd, capture_output=True, text=True, errors='replace', env=env, timeout=timeout)
+		except subprocess.TimeoutExpired:
+			return subprocess.CompletedProcess(cmd, 124, '', f'xelatex 超时（{timeout} 秒）')
+		if res.returncode != 0:
+			return res
+		toc = Path(toc_file).read_bytes() if os.path.exists(toc_file) else None
+		if toc == prev_toc and 'Rerun to get' not in res.stdout:
+			break
+		prev_toc = toc
+	shutil.move(os.path.join(work_dir, f'{stem}.pdf'), out_path)
+	return res
+
+def pdf_header(features: FrozenSet[str] = ALL_FEATURES, draft: bool = False) -> str:
+	"""PDF 的 header-includes：草稿模式用精简 header，否则按文档特性组合"""
+	return DRAFT_HEADER if draft else compose_preamble(features)
+
+def markdown_to_latex(source: str, tex_path: str, header: str, doc_title: str, work_dir: str, draft: bool = False,
+                      input_format: Optional[str] = None, use_server: bool = False,
+                      with_toc: bool = True) -> subprocess.CompletedProcess:
+	"""第一步：pandoc 生成 .tex；use_server=True 时走常驻 pandoc server，否则启动 pandoc 命令"""
+	with metrics.timed('pandoc'):
+		if use_server:
+			options = pandoc_latex_options(doc_title, draft, with_toc)
+			return pandoc_server.convert_to_latex(source, tex_path, header, options, input_format=input_format)
+		header_file = os.path.join(work_dir, 'pandoc_hyperref_setup.tex')
+		with open(header_file, 'w', encoding='utf-8') as f:
+			f.write(header)
+		cmd = pandoc_latex_cmd(source, tex_path, header_file, doc_title, draft=draft, input_format=input_format,
+		                       with_toc=with_toc)
+		return subprocess.run(cmd, capture_output=True, text=True)
+
+def latex_to_pdf(tex_path: str, out_path: str, draft: bool = False) -> subprocess.CompletedProcess:
+	"""第二步：xelatex 编译（草稿模式只编译一遍）"""
+	with metrics.timed('xelatex'):
+		return compile_latex(tex_path, out_path, max_passes=1 if draft else 3)
+
+def source_to_latex(source: str, tex_path: str, doc_title: str, work_dir: str, draft: bool = False,
+                    input_format: Optional[str] = None, extra_header: str = '',
+                    features: FrozenSet[str] = ALL_FEATURES, use_server: bool = False,
+                    with_toc: bool = True) -> subprocess.CompletedProcess:
+	"""按文档特性组合 header，把预处理后的源文件（Markdown 或 pandoc JSON）转换为 .tex"""
+	# 追加的共享 header 片段（如 manifest 中声明的 headers）
+	header = pdf_header(features, draft) + extra_header
+	return markdown_to_latex(source, tex_path, header, doc_title, work_dir, draft=draft,
+	                         input_format=input_format, use_server=use_server, with_toc=with_toc)
+
+def render_pdf(source: str, out_path: str, doc_title: str, work_dir: str, draft: bool = False,
+               input_format: Optional[str] = None, extra_header: str = '',
+               features: FrozenSet[str] = ALL_FEATURES, use_server: bool = False) -> subprocess.CompletedProcess:
+	"""在 work_dir 中把预处理后的源文件（Markdown 或 pandoc JSON）渲染为 PDF"""
+	tex_path = os.path.join(work_dir, 'temp_processed.tex')
+	res = source_to_latex(source, tex_path, doc_title, work_dir, draft=draft, input_format=input_format,
+	                      extra_header=extra_header, features=features, use_server=use_server)
+	if res.returncode == 0:
+		res = latex_to_pdf(tex_path, out_path, draft=draft)
+	return res
+
+def record_result(res: subprocess.CompletedProcess, out_path: str) -> None:
+	"""记录转换结果指标：成功数与输出字节数，或按失败类别（pandoc/xelatex/timeout）计数"""
+	if res.returncode == 0:
+		metrics.inc('md2pdf_documents_converted_total')
+		metrics.inc('md2pdf_output_bytes_total', os.path.getsize(out_path))
+	else:
+		reason = 'timeout' if res.returncode == 124 else Path(str(res.args[0])).name
+		metrics.inc('md2pdf_documents_failed_total', reason=reason)
+
+def default_out_path(md_path: str, draft: bool = False, out_dir: str = '../pdf_docs') -> str:
+	"""默认输出路径：<out_dir>/<文件名>_final_clickable_clean.pdf（草稿为 _draft.pdf）"""
+	Path(out_dir).mkdir(parents=True, exist_ok=True)
+	suffix = 'draft' if draft else 'final_clickable_clean'
+	return str(Path(out_dir) / f"{Path(md_path).stem}_{suffix}.pdf")
+
+def prepare_latex(md_path: str, tex_path: str, draft: bool = False, extra_header: str = '',
+                  use_server: bool = False, with_toc: bool = True) -> subprocess.CompletedProcess:
+	"""前半段：读取并预处理 Markdown，由 pandoc 生成 .tex（中间文件放在 tex_path 所在目录）
+	with_toc=False 时不生成目录（如书籍模式的章节，由合并后的书统一生成）"""
+	# 预处理Markdown文件，确保列表格式正确
+	with metrics.timed('preprocess'):
+		with open(md_path, 'r', encoding='utf-8') as f:
+			content = f.read()
+		metrics.inc('md2pdf_input_bytes_total', len(content.encode('utf-8')))
+		
+		# 提取文档标题
+		doc_title = extract_title_from_markdown(content)
+		
+		# 优化Markdown格式，保持原有结构；拆分超长代码块与表格
+		content = split_oversized_blocks(preprocess_markdown_parallel(content))
+		# 图片相对 Markdown 所在目录解析（与 manifest 的图片依赖一致）
+		content = resolve_image_paths(content, os.path.dirname(os.path.abspath(md_path)))
+	
+	work_dir = os.path.dirname(os.path.abspath(tex_path))
+	temp_md = os.path.join(work_dir, 'temp_processed.md')
+	with open(temp_md, 'w', encoding='utf-8') as f:
+		f.write(content)
+	return source_to_latex(temp_md, tex_path, doc_title, work_dir, draft=draft, extra_header=extra_header,
+	                       features=detect_features(content), use_server=use_server, with_toc=with_toc)
+
+def build(md_path: str, out_path: Optional[str] = None, draft: bool = False, extra_header: str = '',
+          use_server: bool = False) -> bool:
+	"""转换单个 Markdown 文件；draft=True 为快速预览：无目录、单遍编译、轻量字体、图片占位"""
+	if out_path is None:
+		out_path = default_out_path(md_path, draft)
+	
+	# 创建临时工作目录，存放处理后的文件、header、.tex 与编译中间文件
+	work_dir = tempfile.mkdtemp(prefix='md2pdf_')
+	tex_path = os.path.join(work_dir, 'temp_processed.tex')
+	res = prepare_latex(md_path, tex_path, draft=draft, extra_header=extra_header, use_server=use_server)
+	if res.returncode == 0:
+		res = latex_to_pdf(tex_path, out_path, draft=draft)
+	record_result(res, out_path)
 	if res.returncode == 0:
 		print(f"✅ 成功转换: {md_path} -> {out_path}")
 		ok = True
 	else:
-		print("❌ 转换失败:\n" + res.stderr)
+		print("❌ 转换失败:\n" + (res.stderr or res.stdout[-3000:]))
 		ok = False
 	# 清理临时文件
-	if os.path.exists(header_file):
-		os.remove(header_file)
-	if os.path.exists(temp_md):
-		os.remove(temp_md)
+	shutil.rmtree(work_dir, ignore_errors=True)
 	return ok
 
 
+def measure_preamble(features: FrozenSet[str] = ALL_FEATURES, draft: bool = False) -> Optional[Dict[str, float]]:
+	"""测量每遍 xelatex 加载导言区的耗时：编译只含导言区的空文档，另测不带 header 的基线；失败时返回 None"""
+	import time
+	timings = {}
+	work_dir = tempfile.mkdtemp(prefix='md2pdf_preamble_')
+	try:
+		empty_md = os.path.join(work_dir, 'empty.md')
+		with open(empty_md, 'w', encoding='utf-8') as f:
+			f.write('')
+		for name, header in (('template', ''), ('with_header', pdf_header(features, draft))):
+			header_file = os.path.join(work_dir, f'{name}_header.tex')
+			with open(header_file, 'w', encoding='utf-8') as f:
+				f.write(header)
+			tex_path = os.path.join(work_dir, f'{name}.tex')
+			cmd = pandoc_latex_cmd(empty_md, tex_path, header_file, 'preamble', draft=draft)
+			res = subprocess.run(cmd, capture_output=True, text=True)
+			if res.returncode == 0:
+				start = time.perf_counter()
+				res = subprocess.run(['xelatex', '-interaction=nonstopmode', f'-output-directory={work_dir}', tex_path],
+				                     capture_output=True, text=True, errors='replace')
+				timings[name] = time.perf_counter() - start
+			if res.returncode != 0:
+				print("❌ 导言区测量失败:\n" + (res.stderr or res.stdout[-3000:]))
+				return None
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+	timings['header'] = timings['with_header'] - timings['template']
+	return timings
+
+# PDF 之外的输出格式：各自的 pandoc 参数；模板通过 build_formats(templates=...) 指定
+FORMAT_OPTIONS = {
+	'html': ['--standalone', '--toc', '--toc-depth=3', '--metadata', 'toc-title=目录'],
+	'docx': ['--toc', '--toc-depth=3'],
+}
+# 各格式对应的模板参数
+TEMPLATE_OPTIONS = {
+	'html': '--template',
+	'docx': '--reference-doc',
+}
+
+def build_formats(md_path: str, formats: List[str], out_dir: Optional[str] = None,
+                  templates: Optional[Dict[str, str]] = None, use_server: bool = False,
+                  draft: bool = False) -> Dict[str, bool]:
+	"""一次预处理、一次 pandoc 解析（JSON AST），再并发渲染多种输出格式（pdf/html/docx）
+	draft=True 时 PDF 按草稿模式渲染（输出为 _draft.pdf），其它格式不受影响"""
+	templates = templates or {}
+	if not formats:
+		raise ValueError("未指定输出格式")
+	unknown = [fmt for fmt in formats if fmt != 'pdf' and fmt not in FORMAT_OPTIONS]
+	if unknown:
+		raise ValueError(f"不支持的输出格式: {', '.join(unknown)}")
+	unknown = [fmt for fmt in templates if fmt not in TEMPLATE_OPTIONS]
+	if unknown:
+		raise ValueError(f"不支持指定模板的格式: {', '.join(unknown)}")
+	if out_dir is None:
+		out_dir = '../pdf_docs'
+	Path(out_dir).mkdir(parents=True, exist_ok=True)
+	stem = Path(md_path).stem
+
+	with metrics.timed('preprocess'):
+		with open(md_path, 'r', encoding='utf-8') as f:
+			content = f.read()
+		metrics.inc('md2pdf_input_bytes_total', len(content.encode('utf-8')))
+		doc_title = extract_title_from_markdown(content)
+		content = split_oversized_blocks(preprocess_markdown_parallel(content))
+		content = resolve_image_paths(content, os.path.dirname(os.path.abspath(md_path)))
+
+	work_dir = tempfile.mkdtemp(prefix='md2pdf_')
+	try:
+		temp_md = os.path.join(work_dir, 'temp_processed.md')
+		with open(temp_md, 'w', encoding='utf-8') as f:
+			f.write(content)
+
+		# Markdown 只解析一次，各格式都从 JSON AST 渲染
+		ast_path = os.path.join(work_dir, 'temp_processed.json')
+		with metrics.timed('pandoc'):
+			res = subprocess.run([
+				'pandoc', temp_md,
+				'-t', 'json',
+				'--metadata', f'title={doc_title}',
+				'--metadata', 'author=',
+				'--metadata', 'date=',
+				'-o', ast_path,
+			], capture_output=True, text=True)
+		if res.returncode != 0:
+			print("❌ Markdown 解析失败:\n" + res.stderr)
+			metrics.inc('md2pdf_documents_failed_total', len(formats), reason='pandoc')
+			return {fmt: False for fmt in formats}
+
+		def render(fmt: str) -> subprocess.CompletedProcess:
+			suffix = 'draft' if draft and fmt == 'pdf' else 'final_clickable_clean'
+			out_path = os.path.join(out_dir, f"{stem}_{suffix}.{fmt}")
+			if fmt == 'pdf':
+				# PDF 的 header/.tex 放在独立子目录，避免与其它格式互相干扰
+				pdf_dir = os.path.join(work_dir, 'pdf')
+				os.mkdir(pdf_dir)
+				res = render_pdf(ast_path, out_path, doc_title, pdf_dir, draft=draft, input_format='json',
+				                 features=detect_features(content), use_server=use_server)
+			else:
+				cmd = ['pandoc', ast_path, '-f', 'json', '--wrap=none', *FORMAT_OPTIONS[fmt]]
+				if fmt in templates:
+					cmd += [TEMPLATE_OPTIONS[fmt], templates[fmt]]
+				cmd += ['-o', out_path]
+				with metrics.timed('pandoc'):
+					res = subprocess.run(cmd, capture_output=True, text=True)
+			record_result(res, out_path)
+			if res.returncode == 0:
+				print(f"✅ 成功转换: {md_path} -> {out_path}")
+			else:
+				print(f"❌ {fmt} 转换失败:\n" + (res.stderr or res.stdout[-3000:]))
+			return res
+
+		with ThreadPoolExecutor(max_workers=len(formats)) as pool:
+			results = dict(zip(formats, pool.map(render, formats)))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+	return {fmt: res.returncode == 0 for fmt, res in results.items()}
+
+
 def main():
-	import sys
+	import argparse
+	parser = argparse.ArgumentParser(description='Markdown 转 PDF（可点击目录 + 书签 + 格式优化）')
+	parser.add_argument('md', nargs='?', default='../docs/score_doc/简化版评分体系设计文档.md', help='Markdown 文件路径')
+	parser.add_argument('-o', '--output', help='输出 PDF 路径（--formats 时为输出目录，默认 ../pdf_docs/）')
+	parser.add_argument('--draft', action='store_true', help='快速预览：无目录、单遍编译、轻量字体、图片占位')
+	parser.add_argument('--formats', help='一次生成多种格式，逗号分隔，如 pdf,html,docx')
+	parser.add_argument('--template', action='append', default=[], metavar='FMT=PATH',
+	                    help='--formats 时某格式的模板（html 为 --template，docx 为 --reference-doc），可重复')
+	parser.add_argument('--metrics-file', help='结束时把运行指标写入该文件（Prometheus 文本格式）')
+	parser.add_argument('--preamble-report', action='store_true', help='报告该文档导言区每遍的加载耗时')
+	parser.add_argument('--pandoc-server', action='store_true', help='Markdown -> LaTeX 使用常驻 pandoc server')
+	args = parser.parse_args()
+
 	print("🚀 最终稳定版（可点击目录 + 书签 + 格式优化）")
-	for bin_ in ('pandoc', 'xelatex'):
-		try:
-			subprocess.run([bin_, '--version'], capture_output=True, check=True)
-		except Exception:
-			print(f"❌ 缺少 {bin_}")
-			return
-	
-	# 检查命令行参数
-	if len(sys.argv) > 1:
-		md = sys.argv[1]
-	else:
-		md = '../docs/score_doc/简化版评分体系设计文档.md'
+	# 工具链探测结果有缓存，二进制未变化时不再执行 --version
+	for bin_ in missing_binaries(probe_toolchain()):
+		print(f"❌ 缺少 {bin_}")
+		return
 	
+	md = args.md
 	if not os.path.exists(md):
 		print(f"❌ 文件不存在: {md}")
 		return
-	build(md)
+	if args.preamble_report:
+		with open(md, 'r', encoding='utf-8') as f:
+			features = detect_features(preprocess_markdown(f.read()))
+		timings = measure_preamble(features, draft=args.draft)
+		if timings is None:
+			return
+		print(f"⏱️ 导言区加载: {timings['with_header']:.2f}s（模板 {timings['template']:.2f}s + header {timings['header']:.2f}s），"
+		      f"按需加载: {', '.join(sorted(features)) or '无'}")
+	if args.template and args.formats is None:
+		print("❌ --template 只用于 --formats")
+		return
+	if args.formats is not None:
+		formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+		if not formats:
+			print("❌ --formats 未指定任何输出格式")
+			return
+		templates = {}
+		for item in args.template:
+			fmt, sep, path = item.partition('=')
+			if not sep or fmt.strip() not in TEMPLATE_OPTIONS:
+				print(f"❌ --template 格式应为 {'/'.join(TEMPLATE_OPTIONS)}=路径: {item}")
+				return
+			if not os.path.exists(path):
+				print(f"❌ 模板文件不存在: {path}")
+				return
+			templates[fmt.strip()] = path
+		build_formats(md, formats, args.output, templates=templates, use_server=args.pandoc_server,
+		              draft=args.draft)
+	else:
+		if args.draft:
+			print("📝 草稿模式：跳过目录，单遍编译")
+		build(md, args.output, draft=args.draft, use_server=args.pandoc_server)
+	if args.metrics_file:
+		metrics.write_textfile(args.metrics_file)
 	print('🎉 完成，输出目录 pdf_docs/')
 
 if __name__ == '__main__':
@@ -15,6 +15,8 @@ import re
 from pathlib import Path
 from typing import Optional
 
+from toolchain import missing_binaries, probe_toolchain
+
 def clean_emojis_simple(content: str) -> str:
     """简单清理emoji，只处理常见emoji，避免过度处理"""
     
@@ -368,12 +370,10 @@ def build(md_path: str, out_path: Optional[str] = None) -> bool:
 def main():
     import sys
     print("🧹 简化Emoji清理版（可点击目录 + 书签 + 格式优化）")
-    for bin_ in ('pandoc', 'xelatex'):
-        try:
-            subprocess.run([bin_, '--version'], capture_output=True, check=True)
-        except Exception:
-            print(f"❌ 缺少 {bin_}")
-            return
+    # 工具链探测结果有缓存，二进制未变化时不再执行 --version
+    for bin_ in missing_binaries(probe_toolchain()):
+        print(f"❌ 缺少 {bin_}")
+        return
     
     # 检查命令行参数
     if len(sys.argv) > 1:
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于 manifest 的增量构建（类 make）
+- manifest 为 JSON：声明每个输出的 Markdown 输入、共享 header 片段、图片与选项
+- 记录每个输出的依赖（源文件、header 片段、图片、header 模板、字体、工具链指纹）及其哈希
+- 只重建依赖发生变化的输出；多个输出并行构建，按预测成本短任务优先
+- --dry-run 只说明每个输出为什么需要重建
+
+manifest 示例：
+{
+  "options": {"draft": false, "pandoc_server": true},
+  "targets": [
+    {
+      "output": "../pdf_docs/handbook.pdf",
+      "inputs": ["docs/intro.md", "docs/api.md"],
+      "headers": ["shared/extra.tex"],
+      "images": ["docs/img/arch.png"],
+      "options": {"draft": true}
+    }
+  ]
+}
+路径均相对于 manifest 所在目录；Markdown 中引用的本地图片会自动加入依赖。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import final_clickable_toc as toc
+import metrics
+from scheduler import CostModel, job_features
+from toolchain import probe_toolchain, toolchain_fingerprint
+
+
+def file_hash(path: str) -> str:
+	"""文件内容的 sha256；文件不存在时返回 'missing'"""
+	if not os.path.exists(path):
+		return 'missing'
+	h = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+def text_hash(text: str) -> str:
+	return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def load_manifest(manifest_path: str) -> List[dict]:
+	"""读取 manifest，返回已解析为绝对路径、合并了全局选项的 target 列表"""
+	with open(manifest_path, 'r', encoding='utf-8') as f:
+		data = json.load(f)
+	base = Path(manifest_path).resolve().parent
+	defaults = data.get('options', {})
+	targets = []
+	for item in data.get('targets', []):
+		if 'output' not in item or not item.get('inputs'):
+			raise ValueError(f"manifest 条目缺少 output 或 inputs: {item}")
+		targets.append({
+			'output': str(base / item['output']),
+			'inputs': [str(base / p) for p in item['inputs']],
+			'headers': [str(base / p) for p in item.get('headers', [])],
+			'images': [str(base / p) for p in item.get('images', [])],
+			'options': {**defaults, **item.get('options', {})},
+		})
+	return targets
+
+
+def referenced_images(md_path: str) -> List[str]:
+	"""Markdown 中引用的本地图片（相对 Markdown 所在目录，与构建时的解析方式相同）"""
+	if not os.path.exists(md_path):
+		return []
+	with open(md_path, 'r', encoding='utf-8') as f:
+		content = f.read()
+	base_dir = str(Path(md_path).resolve().parent)
+	images = []
+	for ref in toc.image_references(content):
+		path = toc.local_image_path(ref, base_dir)
+		if path is not None:
+			images.append(path)
+	return images
+
+
+def font_fingerprint(font: str, probe: dict) -> str:
+	"""字体文件的哈希（通过 fc-match 定位）；无法定位时退化为字体名本身"""
+	if not probe['features']['fc_match']:
+		return text_hash(font)
+	try:
+		res = subprocess.run(['fc-match', '-f', '%{file}', font], capture_output=True, text=True, check=True)
+	except Exception:
+		return text_hash(font)
+	return file_hash(res.stdout.strip()) if res.stdout.strip() else text_hash(font)
+
+
+def collect_dependencies(target: dict, toolchain: str, fonts: Dict[str, str]) -> Dict[str, str]:
+	"""某个输出的全部依赖及其哈希"""
+	options = target['options']
+	deps = {}
+	for path in target['inputs']:
+		deps[f'source:{path}'] = file_hash(path)
+		for image in referenced_images(path):
+			deps[f'image:{image}'] = file_hash(image)
+	for path in target['headers']:
+		deps[f'header:{path}'] = file_hash(path)
+	for path in target['images']:
+		deps[f'image:{path}'] = file_hash(path)
+	# 按需加载的部分由源文件决定（已作为依赖），这里记录完整 header 模板
+	deps['header-text'] = text_hash(toc.pdf_header(draft=bool(options.get('draft'))))
+	deps['options'] = text_hash(json.dumps(options, sort_keys=True))
+	for font, fingerprint in fonts.items():
+		deps[f'font:{font}'] = fingerprint
+	deps['toolchain'] = toolchain
+	return deps
+
+
+def stale_reasons(target: dict, deps: Dict[str, str], recorded: Optional[Dict[str, str]]) -> List[str]:
+	"""输出需要重建的原因；为空表示已是最新"""
+	if not os.path.exists(target['output']):
+		return ['输出文件不存在']
+	if recorded is None:
+		return ['没有构建记录']
+	reasons = []
+	for key, value in deps.items():
+		if key not in recorded:
+			reasons.append(f'新增依赖 {key}')
+		elif recorded[key] != value:
+			reasons.append(f'依赖已变化 {key}')
+	for key in recorded:
+		if key not in deps:
+			reasons.append(f'依赖已移除 {key}')
+	return reasons
+
+
+def build_target(target: dict) -> bool:
+	"""构建单个输出：多个输入按顺序拼接，共享 header 片段追加到 header-includes"""
+	extra_header = ''
+	for path in target['headers']:
+		with open(path, 'r', encoding='utf-8') as f:
+			extra_header += '\n' + f.read()
+	Path(target['output']).parent.mkdir(parents=True, exist_ok=True)
+	draft = bool(target['options'].get('draft'))
+	use_server = bool(target['options'].get('pandoc_server'))
+	if len(target['inputs']) == 1:
+		return toc.build(target['inputs'][0], target['output'], draft=draft, extra_header=extra_header,
+		                 use_server=use_server)
+
+	work_dir = tempfile.mkdtemp(prefix='md2pdf_manifest_')
+	try:
+		combined = os.path.join(work_dir, Path(target['output']).stem + '.md')
+		with open(combined, 'w', encoding='utf-8') as out:
+			for path in target['inputs']:
+				with open(path, 'r', encoding='utf-8') as f:
+					content = f.read()
+				# 拼接文件位于临时目录，图片需先按各输入所在目录解析
+				content = toc.resolve_image_paths(content, str(Path(path).resolve().parent))
+				out.write(content.rstrip('\n') + '\n\n')
+		return toc.build(combined, target['output'], draft=draft, extra_header=extra_header, use_server=use_server)
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def state_path(manifest_path: str) -> str:
+	return str(Path(manifest_path).with_suffix('.state.json'))
+
+
+def run_manifest(manifest_path: str, dry_run: bool = False, jobs: Optional[int] = None) -> bool:
+	"""按 manifest 增量构建；返回是否全部成功"""
+	targets = load_manifest(manifest_path)
+	state_file = state_path(manifest_path)
+	state = {}
+	if os.path.exists(state_file):
+		with open(state_file, 'r', encoding='utf-8') as f:
+			state = json.load(f)
+
+	# 与 main() 共用同一份工具链探测缓存，指纹作为依赖之一
+	probe = probe_toolchain()
+	toolchain = toolchain_fingerprint(probe)
+	fonts = {font: font_fingerprint(font, probe) for font in (toc.MAIN_FONT, toc.CJK_FONT)}
+
+	pending = []
+	for target in targets:
+		deps = collect_dependencies(target, toolchain, fonts)
+		reasons = stale_reasons(target, deps, state.get(target['output']))
+		metrics.inc('md2pdf_cache_requests_total', cache='manifest', result='miss' if reasons else 'hit')
+		if reasons:
+			print(f"🔄 {target['output']}")
+			for reason in reasons:
+				print(f"   - {reason}")
+			pending.append((target, deps))
+		else:
+			print(f"✅ 已是最新: {target['output']}")
+
+	if dry_run or not pending:
+		return True
+
+	# 预测成本，短任务先启动；实际耗时记录下来用于修正预测
+	model = CostModel()
+	for target, deps in pending:
+		target['features'] = job_features([p for p in target['inputs'] if os.path.exists(p)])
+		target['predicted'] = model.predict(target['output'], target['features'])
+	pending.sort(key=lambda item: item[0]['predicted'])
+
+	remaining = len(pending)
+	metrics.set_gauge('md2pdf_queue_depth', remaining)
+	lock = threading.Lock()
+
+	def run(item) -> bool:
+		nonlocal remaining
+		target = item[0]
+		start = time.perf_counter()
+		try:
+			ok = build_target(target)
+		except Exception as e:
+			# 单个输出失败（如 header 文件缺失）不影响其它输出的构建记录
+			print(f"❌ 构建异常: {target['output']}: {e}")
+			ok = False
+		model.record(target['output'], target['features'], target['predicted'],
+		             time.perf_counter() - start, 'batch', ok)
+		with lock:
+			remaining -= 1
+			metrics.set_gauge('md2pdf_queue_depth', remaining)
+		return ok
+
+	with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+		results = list(pool.map(run, pending))
+
+	for (target, deps), ok in zip(pending, results):
+		if ok:
+			state[target['output']] = deps
+		else:
+			state.pop(target['output'], None)
+	with open(state_file, 'w', encoding='utf-8') as f:
+		json.dump(state, f, ensure_ascii=False, indent=2)
+	return all(results)
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description='基于 manifest 的增量 PDF 构建')
+	parser.add_argument('manifest', help='manifest JSON 文件路径')
+	parser.add_argument('-n', '--dry-run', action='store_true', help='只列出需要重建的输出及原因')
+	parser.add_argument('-j', '--jobs', type=int, help='并行构建数（默认 CPU 核数）')
+	parser.add_argument('--metrics-file', help='结束时把运行指标写入该文件（Prometheus 文本格式）')
+	args = parser.parse_args()
+
+	if not os.path.exists(args.manifest):
+		print(f"❌ 文件不存在: {args.manifest}")
+		return
+	ok = run_manifest(args.manifest, dry_run=args.dry_run, jobs=args.jobs)
+	if args.metrics_file:
+		metrics.write_textfile(args.metrics_file)
+	print('🎉 完成' if ok else '❌ 部分输出构建失败')
+
+if __name__ == '__main__':
+	main()
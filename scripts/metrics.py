@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标：计数器、耗时直方图、队列深度，导出为 Prometheus 文本格式
+- 各阶段耗时（preprocess / pandoc / xelatex）记录为直方图
+- 文档成功/失败（按失败类别）、输入/输出字节数、缓存命中/未命中记录为计数器
+- 可写入文件（配合 node_exporter textfile collector）或在本地端口提供 /metrics
+- 记录只是加锁更新内存中的数字，对转换流程的开销可以忽略
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple
+
+# 直方图桶（秒）
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# 指标名 -> (类型, 说明)
+METRICS = {
+	'md2pdf_documents_converted_total': ('counter', '成功转换的文档数'),
+	'md2pdf_documents_failed_total': ('counter', '转换失败的文档数（按失败类别）'),
+	'md2pdf_stage_duration_seconds': ('histogram', '各阶段耗时'),
+	'md2pdf_input_bytes_total': ('counter', '读取的 Markdown 字节数'),
+	'md2pdf_output_bytes_total': ('counter', '生成的输出文件字节数'),
+	'md2pdf_queue_depth': ('gauge', '批量/服务模式中等待处理的任务数'),
+	'md2pdf_cache_requests_total': ('counter', '缓存查询次数（按缓存与结果 hit/miss）'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_values: Dict[str, Dict[Labels, float]] = {name: {} for name in METRICS}
+# 直方图：labels -> [各桶计数..., sum, count]
+_histograms: Dict[Labels, list] = {}
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+	return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+	"""计数器加 value"""
+	key = _labels(labels)
+	with _lock:
+		series = _values[name]
+		series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+	with _lock:
+		_values[name][_labels(labels)] = value
+
+
+def observe(stage: str, seconds: float) -> None:
+	"""记录一次阶段耗时"""
+	key = _labels({'stage': stage})
+	with _lock:
+		hist = _histograms.get(key)
+		if hist is None:
+			hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+		for i, bound in enumerate(BUCKETS):
+			if seconds <= bound:
+				hist[i] += 1
+		hist[-2] += seconds
+		hist[-1] += 1
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+	"""with timed('pandoc'): ... 记录代码块耗时"""
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		observe(stage, time.perf_counter() - start)
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+	items = labels + extra
+	if not items:
+		return ''
+	return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def _format_value(value: float) -> str:
+	"""精确的数值文本：整数按整数输出，其余浮点数用 repr（不截断有效数字）"""
+	if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
+		return str(int(value))
+	return repr(value)
+
+
+def render() -> str:
+	"""全部指标的 Prometheus 文本格式"""
+	lines = []
+	with _lock:
+		for name, (kind, help_) in METRICS.items():
+			lines.append(f'# HELP {name} {help_}')
+			lines.append(f'# TYPE {name} {kind}')
+			if kind == 'histogram':
+				for labels, hist in sorted(_histograms.items()):
+					for bound, count in zip(BUCKETS, hist):
+						lines.append(f'{name}_bucket{_format_labels(labels, (("le", repr(bound)),))} {count}')
+					lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {hist[-1]}')
+					lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(hist[-2])}')
+					lines.append(f'{name}_count{_format_labels(labels)} {hist[-1]}')
+				continue
+			for labels, value in sorted(_values[name].items()):
+				lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+	return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path: str) -> None:
+	"""原子写入指标文件（先写临时文件再替换）"""
+	tmp = f'{path}.{os.getpid()}.tmp'
+	with open(tmp, 'w', encoding='utf-8') as f:
+		f.write(render())
+	os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path != '/metrics':
+			self.send_error(404)
+			return
+		body = render().encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass  # 不在标准输出打印访问日志
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+	"""在后台线程中提供 http://host:port/metrics"""
+	server = ThreadingHTTPServer((host, port), _MetricsHandler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻 pandoc server：Markdown -> LaTeX 不再每次启动 pandoc 进程
+- 在 127.0.0.1 的空闲端口上启动 `pandoc server`（或 pandoc-server），进程内共享
+- 每个线程复用一条 keep-alive HTTP 连接
+- server 进程退出或连接断开时自动重启并重试一次
+- 选项与命令行路径共用 pandoc_latex_options()，输出应逐字节一致（见 tests/test_pandoc_server.py）
+"""
+
+import atexit
+import http.client
+import json
+import socket
+import subprocess
+import threading
+import time
+from typing import Optional, Tuple
+
+from toolchain import probe_toolchain
+
+# 单次请求超时（秒），同时作为 server 端的 --timeout
+REQUEST_TIMEOUT = 300
+STARTUP_TIMEOUT = 10
+
+
+class PandocServer:
+	"""本地 pandoc server 进程及其连接池"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._local = threading.local()
+		self._process: Optional[subprocess.Popen] = None
+		self._port = 0
+		# 每次重启递增，线程据此丢弃指向旧进程的连接
+		self._generation = 0
+
+	def _command(self, port: int) -> list:
+		probe = probe_toolchain()
+		if probe['tools'].get('pandoc-server'):
+			return ['pandoc-server', '--port', str(port), '--timeout', str(REQUEST_TIMEOUT)]
+		return ['pandoc', 'server', '--port', str(port), '--timeout', str(REQUEST_TIMEOUT)]
+
+	def _start(self) -> None:
+		"""启动 server 并等待端口可连接（调用方持有锁）"""
+		with socket.socket() as sock:
+			sock.bind(('127.0.0.1', 0))
+			port = sock.getsockname()[1]
+		self._process = subprocess.Popen(self._command(port), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		deadline = time.monotonic() + STARTUP_TIMEOUT
+		while True:
+			if self._process.poll() is not None:
+				raise RuntimeError('pandoc server 启动失败')
+			try:
+				socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+				break
+			except OSError:
+				if time.monotonic() > deadline:
+					self._stop()
+					raise RuntimeError('pandoc server 启动超时')
+				time.sleep(0.05)
+		self._port = port
+		self._generation += 1
+
+	def _stop(self) -> None:
+		if self._process and self._process.poll() is None:
+			self._process.terminate()
+			try:
+				self._process.wait(timeout=5)
+			except subprocess.TimeoutExpired:
+				self._process.kill()
+		self._process = None
+
+	def _ensure_running(self, failed_generation: Optional[int] = None) -> Tuple[int, int]:
+		"""返回可用的 (generation, 端口)；进程未启动或已退出时启动新进程
+		failed_generation 为调用方请求失败时所用的 generation：只有它仍是当前进程时才重启，
+		避免多个线程同时失败时互相杀掉对方刚启动的进程"""
+		with self._lock:
+			if (self._process is None or self._process.poll() is not None
+			        or failed_generation == self._generation):
+				self._stop()
+				self._start()
+			return self._generation, self._port
+
+	def _connection(self, generation: int, port: int) -> http.client.HTTPConnection:
+		conn = getattr(self._local, 'conn', None)
+		if conn is None or self._local.generation != generation:
+			if conn is not None:
+				conn.close()
+			conn = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+			self._local.conn = conn
+			self._local.generation = generation
+		return conn
+
+	def _post(self, generation: int, port: int, body: bytes) -> dict:
+		conn = self._connection(generation, port)
+		try:
+			conn.request('POST', '/', body=body, headers={
+				'Content-Type': 'application/json',
+				'Accept': 'application/json',
+			})
+			resp = conn.getresponse()
+			data = resp.read()
+		except (OSError, http.client.HTTPException):
+			conn.close()
+			self._local.conn = None
+			raise
+		if resp.status != 200:
+			raise ValueError(data.decode('utf-8', errors='replace'))
+		return json.loads(data)
+
+	def convert(self, payload: dict) -> str:
+		"""提交一次转换，返回输出文本
+		连接异常时先用新连接重试（server 会关闭空闲的 keep-alive 连接，如排版耗时较长的线程），
+		只有进程已退出或新连接也失败时才重启 server 再重试"""
+		body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+		generation, port = self._ensure_running()
+		try:
+			result = self._post(generation, port, body)
+		except (OSError, http.client.HTTPException):
+			# 失败的连接已丢弃；进程仍在运行时不重启
+			generation, port = self._ensure_running()
+			try:
+				result = self._post(generation, port, body)
+			except (OSError, http.client.HTTPException):
+				generation, port = self._ensure_running(failed_generation=generation)
+				result = self._post(generation, port, body)
+		return result['output']
+
+	def close(self) -> None:
+		with self._lock:
+			self._stop()
+
+
+_server: Optional[PandocServer] = None
+_server_lock = threading.Lock()
+
+
+def get_server() -> PandocServer:
+	"""进程内共享的 server 实例（首次使用时创建，退出时关闭）"""
+	global _server
+	with _server_lock:
+		if _server is None:
+			_server = PandocServer()
+			atexit.register(_server.close)
+		return _server
+
+
+def latex_payload(text: str, header: str, options: dict, input_format: Optional[str] = None) -> dict:
+	"""把 pandoc_latex_options() 的结果转换为 server 请求；-H 的内容即 header-includes 变量"""
+	return {
+		'text': text,
+		'from': input_format or 'markdown',
+		'to': 'latex',
+		'standalone': True,
+		'wrap': 'none',
+		'table-of-contents': options['toc'],
+		'variables': {**options['variables'], 'header-includes': header},
+		'metadata': options['metadata'],
+	}
+
+
+def convert_to_latex(source: str, tex_path: str, header: str, options: dict,
+                     input_format: Optional[str] = None) -> subprocess.CompletedProcess:
+	"""通过常驻 server 把源文件转换为 .tex；返回与 subprocess.run 相同形式的结果
+	（args[0] 为 pandoc，失败时与命令行路径计入同一失败类别）"""
+	cmd = ['pandoc', 'server', source]
+	with open(source, 'r', encoding='utf-8') as f:
+		text = f.read()
+	try:
+		output = get_server().convert(latex_payload(text, header, options, input_format))
+	except (OSError, RuntimeError, ValueError, http.client.HTTPException) as e:
+		return subprocess.CompletedProcess(cmd, 1, '', f'pandoc server 转换失败: {e}')
+	with open(tex_path, 'w', encoding='utf-8') as f:
+		f.write(output)
+	return subprocess.CompletedProcess(cmd, 0, '', '')
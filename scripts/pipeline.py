@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+两段式流水线批量转换
+- 第一段（读取、正则预处理、pandoc Markdown -> LaTeX）与第二段（xelatex）各用独立大小的线程池
+- 两段之间是有界队列：第 N 个文档排版时，第 N+1 个文档已在预处理；xelatex 积压时第一段自动等待
+- 中间 .tex 保存为检查点：xelatex 失败可直接重试；源文件与选项未变时再次运行会跳过第一段
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import final_clickable_toc as toc
+import metrics
+from toolchain import probe_toolchain, toolchain_fingerprint
+
+CHECKPOINT_DIR = '.md2pdf_checkpoints'
+# xelatex 失败后的重试次数（只重跑第二段）
+LATEX_RETRIES = 1
+
+_DONE = object()
+
+
+def checkpoint_key(md_path: str, options: dict) -> str:
+	"""检查点有效性：源文件内容 + 选项 + header 模板 + 预处理规则版本 + 工具链指纹"""
+	h = hashlib.sha256()
+	with open(md_path, 'rb') as f:
+		h.update(f.read())
+	h.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+	h.update(toc.pdf_header(draft=options['draft']).encode('utf-8'))
+	h.update(f'preprocess:{toc.PREPROCESS_VERSION}'.encode('utf-8'))
+	h.update(toolchain_fingerprint(probe_toolchain()).encode('utf-8'))
+	return h.hexdigest()
+
+
+def doc_checkpoint_dir(md_path: str, checkpoint_dir: str) -> Path:
+	"""文档的检查点目录：<文件名>-<绝对路径哈希>"""
+	digest = hashlib.sha1(str(Path(md_path).resolve()).encode('utf-8')).hexdigest()[:8]
+	return Path(checkpoint_dir) / f'{Path(md_path).stem}-{digest}'
+
+
+def checkpoint_tex(md_path: str, options: dict, checkpoint_dir: str) -> str:
+	"""生成（或复用）文档的 .tex 检查点，返回 .tex 路径；失败抛出 RuntimeError
+	options: draft、use_server，可选 extra_header（追加的 header 片段）与 with_toc（默认 True）"""
+	doc_dir = doc_checkpoint_dir(md_path, checkpoint_dir)
+	doc_dir.mkdir(parents=True, exist_ok=True)
+	tex_path = str(doc_dir / 'document.tex')
+	meta_path = doc_dir / 'checkpoint.json'
+	key = checkpoint_key(md_path, options)
+	if os.path.exists(tex_path) and meta_path.exists():
+		with open(meta_path, 'r', encoding='utf-8') as f:
+			if json.load(f).get('key') == key:
+				metrics.inc('md2pdf_cache_requests_total', cache='checkpoint', result='hit')
+				return tex_path
+	metrics.inc('md2pdf_cache_requests_total', cache='checkpoint', result='miss')
+	res = toc.prepare_latex(md_path, tex_path, draft=options['draft'], extra_header=options.get('extra_header', ''),
+	                        use_server=options['use_server'], with_toc=options.get('with_toc', True))
+	if res.returncode != 0:
+		toc.record_result(res, '')
+		raise RuntimeError(res.stderr or res.stdout[-3000:])
+	with open(meta_path, 'w', encoding='utf-8') as f:
+		json.dump({'key': key, 'source': str(Path(md_path).resolve())}, f, ensure_ascii=False)
+	return tex_path
+
+
+def run_pipeline(md_paths: List[str], out_dir: Optional[str] = None, prep_workers: int = 2,
+                 latex_workers: Optional[int] = None, queue_size: int = 4, draft: bool = False,
+                 use_server: bool = False, checkpoint_dir: str = CHECKPOINT_DIR) -> Dict[str, bool]:
+	"""两段式流水线转换多个文档，返回 {md_path: 是否成功}"""
+	options = {'draft': draft, 'use_server': use_server}
+	latex_workers = latex_workers or os.cpu_count()
+	results: Dict[str, bool] = {}
+	tex_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+	def prepare(md_path: str) -> None:
+		try:
+			tex_path = checkpoint_tex(md_path, options, checkpoint_dir)
+		except Exception as e:
+			print(f"❌ 预处理/pandoc 失败: {md_path}\n{e}")
+			results[md_path] = False
+			return
+		# 队列满时阻塞，避免第一段远远跑在 xelatex 前面
+		tex_queue.put((md_path, tex_path))
+		metrics.set_gauge('md2pdf_queue_depth', tex_queue.qsize())
+
+	def typeset_one(md_path: str, tex_path: str) -> bool:
+		out_path = toc.default_out_path(md_path, draft, out_dir or '../pdf_docs')
+		for attempt in range(LATEX_RETRIES + 1):
+			res = toc.latex_to_pdf(tex_path, out_path, draft=draft)
+			if res.returncode == 0:
+				break
+			if attempt < LATEX_RETRIES:
+				print(f"🔁 xelatex 失败，使用检查点重试: {md_path}")
+		toc.record_result(res, out_path)
+		if res.returncode == 0:
+			print(f"✅ 成功转换: {md_path} -> {out_path}")
+		else:
+			print(f"❌ 转换失败（检查点保留在 {tex_path}）:\n" + (res.stderr or res.stdout[-3000:]))
+		return res.returncode == 0
+
+	def typeset() -> None:
+		while True:
+			item = tex_queue.get()
+			if item is _DONE:
+				return
+			md_path, tex_path = item
+			metrics.set_gauge('md2pdf_queue_depth', tex_queue.qsize())
+			# 任何异常都只记为该文档失败，线程继续消费队列，避免第一段在 put 上永久阻塞
+			try:
+				results[md_path] = typeset_one(md_path, tex_path)
+			except Exception as e:
+				print(f"❌ 排版异常（检查点保留在 {tex_path}）: {md_path}: {e}")
+				metrics.inc('md2pdf_documents_failed_total', reason='xelatex')
+				results[md_path] = False
+
+	typesetters = [threading.Thread(target=typeset, daemon=True) for _ in range(latex_workers)]
+	for thread in typesetters:
+		thread.start()
+	with ThreadPoolExecutor(max_workers=prep_workers) as pool:
+		list(pool.map(prepare, md_paths))
+	for _ in typesetters:
+		tex_queue.put(_DONE)
+	for thread in typesetters:
+		thread.join()
+	return results
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description='两段式流水线批量 Markdown 转 PDF')
+	parser.add_argument('md', nargs='+', help='Markdown 文件路径')
+	parser.add_argument('-o', '--output', help='输出目录（默认 ../pdf_docs/）')
+	parser.add_argument('--prep-workers', type=int, default=2, help='预处理 + pandoc 线程数')
+	parser.add_argument('--latex-workers', type=int, help='xelatex 并行数（默认 CPU 核数）')
+	parser.add_argument('--queue-size', type=int, default=4, help='两段之间队列的容量')
+	parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR, help='.tex 检查点目录')
+	parser.add_argument('--draft', action='store_true', help='快速预览模式')
+	parser.add_argument('--pandoc-server', action='store_true', help='Markdown -> LaTeX 使用常驻 pandoc server')
+	parser.add_argument('--metrics-file', help='结束时把运行指标写入该文件（Prometheus 文本格式）')
+	parser.add_argument('--metrics-port', type=int, help='运行期间在 127.0.0.1 的该端口提供 /metrics')
+	args = parser.parse_args()
+
+	md_paths = []
+	for md in args.md:
+		if os.path.exists(md):
+			md_paths.append(md)
+		else:
+			print(f"❌ 文件不存在: {md}")
+	if args.metrics_port:
+		metrics.serve(args.metrics_port)
+	results = run_pipeline(md_paths, args.output, prep_workers=args.prep_workers, latex_workers=args.latex_workers,
+	                       queue_size=args.queue_size, draft=args.draft, use_server=args.pandoc_server,
+	                       checkpoint_dir=args.checkpoint_dir)
+	if args.metrics_file:
+		metrics.write_textfile(args.metrics_file)
+	print('🎉 完成' if all(results.values()) else '❌ 部分文档转换失败')
+
+if __name__ == '__main__':
+	main()
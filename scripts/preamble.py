@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+header-includes 组合器
+- 由结构化的样式选项生成 header，每个宏包只加载一次，每项设置只写一次
+- 可选宏包（fancyvrb 代码块环境、titlesec、xurl）只在文档用到相应内容时加载
+- 取值与原先 header 中最终生效的那一组一致（宽松排版以 \\AtBeginDocument 中的为准，列表/段落以后写的为准）
+"""
+
+import re
+from string import Template
+from typing import Dict, FrozenSet, Optional
+
+# 排版样式（与原先 header 最终生效的取值一致）
+DEFAULT_STYLE = {
+	'emergencystretch': '25em',
+	'pretolerance': '30000',
+	'tolerance': '100000',
+	'hbadness': '10000',
+	'parindent': '1.2em',
+	'parskip': '0.8em',
+	'list_leftmargin': '2em',
+	'list_itemsep': '1.0em',
+	'list_parsep': '0.5em',
+	'list_topsep': '0.5em',
+	'list_partopsep': '0.2em',
+	'nested_leftmargin': '2em',
+	'nested_itemsep': '0.3em',
+	'link_color': 'blue',
+	'toc_title': '目录',
+}
+
+# 可按需加载的特性
+ALL_FEATURES = frozenset({'code', 'inline_code', 'headings', 'urls'})
+
+_CODE_FENCE = re.compile(r'^\s*(```|~~~)', re.MULTILINE)
+_INDENTED_CODE = re.compile(r'(^|\n)[ \t]*\n(    |\t)\S')
+_INLINE_CODE = re.compile(r'`[^`\n]+`')
+_HEADING = re.compile(r'^#{1,6}\s', re.MULTILINE)
+_URL = re.compile(r'https?://|ftp://|<[^>\s]+@[^>\s]+>|\]\([^)]+\)')
+
+
+def detect_features(markdown: str) -> FrozenSet[str]:
+	"""检测文档用到的可选特性：代码块、行内代码、标题、链接/URL"""
+	features = set()
+	if _CODE_FENCE.search(markdown) or _INDENTED_CODE.search(markdown):
+		features.add('code')
+	if _INLINE_CODE.search(markdown):
+		features.add('inline_code')
+	if _HEADING.search(markdown):
+		features.add('headings')
+	if _URL.search(markdown):
+		features.add('urls')
+	return frozenset(features)
+
+
+_BASE = Template(r"""
+% 中文与字体（配合 xelatex）
+\usepackage{xeCJK}
+\usepackage{fontspec}
+% 中文自动换行设置
+\XeTeXlinebreaklocale "zh"
+\XeTeXlinebreakskip = 0pt plus 2pt
+
+% 宽松排版，防止文本截断
+\raggedright
+\AtBeginDocument{%
+  \sloppy
+  \emergencystretch=${emergencystretch}
+  \pretolerance=${pretolerance}
+  \tolerance=${tolerance}
+  \hbadness=${hbadness}
+}
+
+\usepackage{xcolor}
+\definecolor{codebg}{RGB}{248,248,248}
+\definecolor{codeframe}{RGB}{220,220,220}
+""")
+
+_URLS = r"""
+% URL 自动换行
+\usepackage{xurl}
+\urlstyle{same}
+"""
+
+_CODE = r"""
+% 改进的代码块和缩进设置
+\usepackage{fancyvrb}
+
+% 主要代码块环境 - 更好的缩进
+\DefineVerbatimEnvironment{Highlighting}{Verbatim}{%
+  fontsize=\small,
+  baselinestretch=1.1,
+  frame=leftline,
+  framerule=2pt,
+  framesep=0.8em,
+  xleftmargin=2.5em,
+  rulecolor=\color{codeframe},
+  commandchars=\\\{\}
+}
+
+% JSON和API代码的特殊环境
+\DefineVerbatimEnvironment{CodeBlock}{Verbatim}{%
+  fontfamily=tt,
+  fontsize=\footnotesize,
+  baselinestretch=1.05,
+  frame=single,
+  framerule=0.4pt,
+  framesep=1.2em,
+  xleftmargin=2em,
+  xrightmargin=1em,
+  rulecolor=\color{codeframe}
+}
+
+% 通用代码块
+\DefineVerbatimEnvironment{Verbatim}{Verbatim}{%
+  fontsize=\small,
+  frame=single,
+  commandchars=\\\{\},
+  xleftmargin=2em,
+  xrightmargin=1em
+}
+"""
+
+_LISTS = Template(r"""
+% 定义列表和段落格式改进
+\usepackage{enumitem}
+
+% 定义描述环境 - 用于功能描述等
+\newenvironment{definitiondesc}{%
+  \begin{list}{}{%
+    \setlength{\leftmargin}{2em}%
+    \setlength{\rightmargin}{0em}%
+    \setlength{\itemindent}{0em}%
+    \setlength{\parsep}{0.3em}%
+    \setlength{\itemsep}{0.2em}%
+  }%
+  \item[]%
+}{%
+  \end{list}%
+}
+
+% 列表间距
+\setlist[itemize]{leftmargin=${list_leftmargin},itemsep=${list_itemsep},parsep=${list_parsep},topsep=${list_topsep},partopsep=${list_partopsep}}
+\setlist[enumerate]{leftmargin=${list_leftmargin},itemsep=${list_itemsep},parsep=${list_parsep},topsep=${list_topsep},partopsep=${list_partopsep}}
+\setlist[itemize,2]{leftmargin=${nested_leftmargin},itemsep=${nested_itemsep}}
+
+% 强制每个列表项单独成行，禁用紧凑模式
+\renewcommand{\tightlist}{%
+  \setlength{\itemsep}{${list_itemsep}}%
+  \setlength{\parskip}{${list_parsep}}%
+  \setlength{\parsep}{${list_parsep}}%
+  \setlength{\topsep}{${list_topsep}}%
+  \setlength{\partopsep}{${list_partopsep}}%
+}
+
+% 段落与缩进
+\setlength{\parindent}{${parindent}}
+\setlength{\parskip}{${parskip}}
+""")
+
+_INLINE_CODE_STYLE = r"""
+% 行内代码的改进样式
+\let\oldtexttt\texttt
+\renewcommand{\texttt}[1]{%
+  \colorbox{codebg}{%
+    \footnotesize\oldtexttt{\hspace{0.2em}#1\hspace{0.2em}}%
+  }%
+}
+"""
+
+_HEADINGS = r"""
+% 改进标题间距
+\usepackage{titlesec}
+\titlespacing*{\section}{0pt}{*3.5}{*2.5}
+\titlespacing*{\subsection}{0pt}{*3}{*2}
+\titlespacing*{\subsubsection}{0pt}{*2.5}{*1.5}
+\titlespacing*{\paragraph}{0pt}{*2}{*1}
+"""
+
+_COMMANDS = Template(r"""
+% 长公式处理
+\newcommand{\longformula}[1]{\sloppypar\noindent\texttt{#1}\par}
+
+% 强制长文本换行
+\newcommand{\forcebreak}[1]{%
+  \sloppy
+  \emergencystretch=20em
+  \pretolerance=20000
+  \tolerance=50000
+  \hbadness=10000
+  #1
+}
+
+% 专门处理长公式的环境
+\newenvironment{longformulaenv}{%
+  \sloppypar
+  \emergencystretch=${emergencystretch}
+  \pretolerance=${pretolerance}
+  \tolerance=${tolerance}
+  \hbadness=${hbadness}
+}{}
+
+% 超链接/书签配置
+\usepackage[unicode=true]{hyperref}
+\hypersetup{
+  colorlinks=true,
+  linkcolor=${link_color},
+  urlcolor=${link_color},
+  citecolor=${link_color},
+  linktoc=all,
+  pdfencoding=auto
+}
+% 避免重复锚点导致跳回目录
+\makeatletter
+\@ifpackageloaded{hyperref}{\hypersetup{hypertexnames=false}}{}
+\makeatother
+
+% 目录标题本地化
+\renewcommand{\contentsname}{${toc_title}}
+
+% 处理标题中的特殊字符
+\makeatletter
+\def\@maketitle{%
+  \newpage
+  \null
+  \vskip 2em%
+  \begin{center}%
+  \let \footnote \thanks
+    {\LARGE \@title \par}%
+    \vskip 1.5em%
+    {\large \lineskip .5em%
+      \begin{tabular}[t]{c}%
+        \@author
+      \end{tabular}\par}%
+    \vskip 1em%
+    {\large \@date}%
+  \end{center}%
+  \par
+  \vskip 1.5em}
+\makeatother
+""")
+
+
+def compose_preamble(features: FrozenSet[str] = ALL_FEATURES, style: Optional[Dict[str, str]] = None) -> str:
+	"""按样式选项和文档特性生成 header-includes"""
+	values = {**DEFAULT_STYLE, **(style or {})}
+	parts = [_BASE.substitute(values)]
+	if 'urls' in features:
+		parts.append(_URLS)
+	if 'code' in features:
+		parts.append(_CODE)
+	parts.append(_LISTS.substitute(values))
+	if 'inline_code' in features:
+		parts.append(_INLINE_CODE_STYLE)
+	if 'headings' in features:
+		parts.append(_HEADINGS)
+	parts.append(_COMMANDS.substitute(values))
+	return ''.join(parts)
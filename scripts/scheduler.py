@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按成本调度的批量/服务模式转换队列
+- 由廉价特征（字节数、标题数、代码块行数、表格行数、图片数）和该文档的历史耗时预测成本
+- 同一优先级内短任务优先；interactive 优先于 batch，batch 优先于 nightly
+- 等待越久优先级越高（aging），保证大任务最终也能执行
+- 每个任务的预测成本与实际耗时记录到日志，用于修正后续预测
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import final_clickable_toc as toc
+import metrics
+
+# 优先级类别 -> 偏移（秒）：较低类别的任务需要等待相应时间后才能与较高类别竞争
+PRIORITY_OFFSETS = {
+	'interactive': 0.0,
+	'batch': 60.0,
+	'nightly': 600.0,
+}
+# 每等待 1 秒，调度分数减少的量
+AGING_RATE = 0.5
+
+# 线性成本模型系数（秒），日志中的实际耗时会按比例修正整体
+COST_MODEL = {
+	'base': 1.5,
+	'bytes': 2e-5,
+	'headings': 0.01,
+	'code_lines': 0.002,
+	'table_rows': 0.003,
+	'images': 0.05,
+}
+# 同一文档历史耗时的指数平滑系数
+HISTORY_ALPHA = 0.5
+# 用于修正整体比例的最近日志条数
+CALIBRATION_WINDOW = 200
+# 日志超过该条数时压缩：只保留最近 CALIBRATION_WINDOW 条与每个文档的平滑历史耗时
+COST_LOG_MAX_ENTRIES = 2000
+
+
+def cost_log_file() -> Path:
+	"""预测/实际耗时日志：$XDG_CACHE_HOME/md2pdf/job_costs.jsonl"""
+	base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return Path(base) / 'md2pdf' / 'job_costs.jsonl'
+
+
+def job_features(md_paths: List[str]) -> Dict[str, int]:
+	"""文档的廉价特征；多个输入按拼接后统计"""
+	features = dict.fromkeys(('bytes', 'headings', 'code_lines', 'table_rows', 'images'), 0)
+	for path in md_paths:
+		with open(path, 'r', encoding='utf-8') as f:
+			content = f.read()
+		features['bytes'] += len(content.encode('utf-8'))
+		features['headings'] += len(re.findall(r'^#{1,6}\s', content, re.MULTILINE))
+		features['code_lines'] += sum(block.count('\n') for block in re.findall(r'```[\s\S]*?```', content))
+		features['table_rows'] += len(re.findall(r'^\s*\|', content, re.MULTILINE))
+		features['images'] += content.count('![')
+	return features
+
+
+def model_cost(features: Dict[str, int]) -> float:
+	return COST_MODEL['base'] + sum(COST_MODEL[key] * value for key, value in features.items())
+
+
+class CostModel:
+	"""成本预测：优先用同一文档的历史耗时，否则用线性模型乘以日志得出的修正比例"""
+
+	def __init__(self, log_path: Optional[Path] = None):
+		self.log_path = log_path or cost_log_file()
+		self._lock = threading.Lock()
+		self._history: Dict[str, float] = {}
+		self._ratios: List[float] = []
+		entries = []
+		if self.log_path.exists():
+			with open(self.log_path, 'r', encoding='utf-8') as f:
+				for line in f:
+					try:
+						entry = json.loads(line)
+						self._learn(entry)
+					except (ValueError, KeyError):
+						continue
+					entries.append(entry)
+		if len(entries) > COST_LOG_MAX_ENTRIES:
+			self._compact(entries[-CALIBRATION_WINDOW:])
+
+	def _compact(self, recent: List[dict]) -> None:
+		"""重写日志：最近的条目（用于修正比例）+ 每个文档一条历史耗时摘要，载入后状态不变"""
+		summaries = [{'doc': doc, 'history': round(value, 3)} for doc, value in self._history.items()]
+		tmp = self.log_path.with_suffix(f'.{os.getpid()}.tmp')
+		try:
+			with open(tmp, 'w', encoding='utf-8') as f:
+				# 摘要写在最近条目之后，载入时覆盖这些条目对同一文档的平滑结果
+				for entry in recent + summaries:
+					f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+			os.replace(tmp, self.log_path)
+		except OSError:
+			pass  # 日志不可写时不影响转换
+
+	def _learn(self, entry: dict) -> None:
+		if 'history' in entry:
+			self._history[entry['doc']] = entry['history']
+			return
+		if not entry.get('ok'):
+			return
+		doc, actual = entry['doc'], entry['actual']
+		prev = self._history.get(doc)
+		self._history[doc] = actual if prev is None else HISTORY_ALPHA * actual + (1 - HISTORY_ALPHA) * prev
+		self._ratios = (self._ratios + [actual / model_cost(entry['features'])])[-CALIBRATION_WINDOW:]
+
+	def predict(self, doc: str, features: Dict[str, int]) -> float:
+		with self._lock:
+			if doc in self._history:
+				return self._history[doc]
+			ratio = sorted(self._ratios)[len(self._ratios) // 2] if self._ratios else 1.0
+		return model_cost(features) * ratio
+
+	def record(self, doc: str, features: Dict[str, int], predicted: float, actual: float,
+	           priority: str, ok: bool) -> None:
+		"""记录一次任务的预测与实际耗时，并更新模型"""
+		entry = {
+			'time': time.time(),
+			'doc': doc,
+			'priority': priority,
+			'features': features,
+			'predicted': round(predicted, 3),
+			'actual': round(actual, 3),
+			'ok': ok,
+		}
+		with self._lock:
+			self._learn(entry)
+			try:
+				self.log_path.parent.mkdir(parents=True, exist_ok=True)
+				with open(self.log_path, 'a', encoding='utf-8') as f:
+					f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+			except OSError:
+				pass  # 日志不可写时不影响转换
+
+
+class Scheduler:
+	"""短任务优先 + 优先级类别 + aging 的转换队列；start() 后可持续 submit（服务模式）"""
+
+	def __init__(self, workers: int = 1, model: Optional[CostModel] = None,
+	             runner: Callable[..., bool] = toc.build):
+		self.workers = workers
+		self.model = model or CostModel()
+		self.runner = runner
+		# 任务编号 -> 是否成功；同一文档可多次提交
+		self.results: Dict[int, bool] = {}
+		self._jobs: List[dict] = []
+		self._next_id = 0
+		self._cond = threading.Condition()
+		self._threads: List[threading.Thread] = []
+		self._closed = False
+
+	def submit(self, md_path: str, out_path: Optional[str] = None, priority: str = 'batch', **build_kwargs) -> int:
+		"""加入队列，返回任务编号（results 的键）"""
+		if priority not in PRIORITY_OFFSETS:
+			raise ValueError(f"未知优先级: {priority}")
+		doc = str(Path(md_path).resolve())
+		features = job_features([md_path])
+		predicted = self.model.predict(doc, features)
+		job = {
+			'md_path': md_path,
+			'out_path': out_path,
+			'doc': doc,
+			'priority': priority,
+			'features': features,
+			'predicted': predicted,
+			'submitted': time.monotonic(),
+			'kwargs': build_kwargs,
+		}
+		with self._cond:
+			job['id'] = self._next_id
+			self._next_id += 1
+			self._jobs.append(job)
+			metrics.set_gauge('md2pdf_queue_depth', len(self._jobs))
+			self._cond.notify()
+		return job['id']
+
+	def _score(self, job: dict, now: float) -> float:
+		waited = now - job['submitted']
+		return PRIORITY_OFFSETS[job['priority']] + job['predicted'] - AGING_RATE * waited
+
+	def _next_job(self) -> Optional[dict]:
+		with self._cond:
+			while not self._jobs and not self._closed:
+				self._cond.wait()
+			if not self._jobs:
+				return None
+			now = time.monotonic()
+			job = min(self._jobs, key=lambda item: self._score(item, now))
+			self._jobs.remove(job)
+			metrics.set_gauge('md2pdf_queue_depth', len(self._jobs))
+			return job
+
+	def _worker(self) -> None:
+		while True:
+			job = self._next_job()
+			if job is None:
+				return
+			start = time.perf_counter()
+			try:
+				ok = self.runner(job['md_path'], job['out_path'], **job['kwargs'])
+			except Exception as e:
+				print(f"❌ 转换异常: {job['md_path']}: {e}")
+				ok = False
+			actual = time.perf_counter() - start
+			self.model.record(job['doc'], job['features'], job['predicted'], actual, job['priority'], ok)
+			print(f"⏱️ {job['md_path']}: 预测 {job['predicted']:.1f}s，实际 {actual:.1f}s")
+			with self._cond:
+				self.results[job['id']] = ok
+
+	def start(self) -> None:
+		for _ in range(self.workers):
+			thread = threading.Thread(target=self._worker, daemon=True)
+			thread.start()
+			self._threads.append(thread)
+
+	def join(self) -> Dict[int, bool]:
+		"""不再接收新任务，等待队列清空后返回 {任务编号: 是否成功}"""
+		with self._cond:
+			self._closed = True
+			self._cond.notify_all()
+		for thread in self._threads:
+			thread.join()
+		return self.results
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description='按成本调度的批量 Markdown 转 PDF')
+	parser.add_argument('md', nargs='+', help='Markdown 文件路径')
+	parser.add_argument('--priority', default='batch', choices=sorted(PRIORITY_OFFSETS), help='优先级类别')
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='并行转换数（默认 CPU 核数）')
+	parser.add_argument('--draft', action='store_true', help='快速预览模式')
+	parser.add_argument('--pandoc-server', action='store_true', help='Markdown -> LaTeX 使用常驻 pandoc server')
+	parser.add_argument('--metrics-file', help='结束时把运行指标写入该文件（Prometheus 文本格式）')
+	parser.add_argument('--metrics-port', type=int, help='运行期间在 127.0.0.1 的该端口提供 /metrics')
+	args = parser.parse_args()
+	if args.metrics_port:
+		metrics.serve(args.metrics_port)
+
+	scheduler = Scheduler(workers=args.jobs)
+	for md in args.md:
+		if not os.path.exists(md):
+			print(f"❌ 文件不存在: {md}")
+			continue
+		scheduler.submit(md, priority=args.priority, draft=args.draft, use_server=args.pandoc_server)
+	scheduler.start()
+	results = scheduler.join()
+	if args.metrics_file:
+		metrics.write_textfile(args.metrics_file)
+	print('🎉 完成' if all(results.values()) else '❌ 部分文档转换失败')
+
+if __name__ == '__main__':
+	main()
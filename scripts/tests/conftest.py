@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""测试从 scripts 目录导入模块（脚本按平铺模块组织，直接在 scripts 目录下运行）"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""分段并行预处理与整篇预处理逐字节一致（chunk_size=0：在每个安全位置都分段）"""
+
+import random
+
+import pytest
+
+import final_clickable_toc as toc
+
+FIXED_DOCS = [
+	'#\n\n# \npara text\n**x**',
+	'# \n\n\n# A\ntext\nmore',
+	'## \n\n# B\n- a\n- b',
+	'# A\n\n```\n# 不是标题\n\n# 也不是\n```\n\n# B\n正文\n正文',
+	'# A\n\n```\n┌──┐\n```\n\n# B\n\n```\n│ x │\n```\n',
+	'# A\n**功能描述**：说明\n第一行\n第二行\n\n# B\n> **注意**：内容\n',
+	'# A\n\n```http\nGET /\n\n# x\n```\n\n# B\n\n```json\n{}\n```\n',
+	'前言\n第二行\n\n# A\n1. 一\n2. 二\n\n# B\n`code` 行\n下一行',
+]
+
+# 随机文档的组成片段：标题（含空标题）、段落、列表、引用、定义块、各类代码块与 ASCII 图表
+FRAGMENTS = [
+	'#', '# ', '##', '# 标题', '## 小节', '#### 1.2 接口API',
+	'段落文字', '另一行 `code`', '**粗体**', '*生命周期阶段：设计*',
+	'- 列表项', '1. 编号项', '> **提示**：内容',
+	'**功能描述**：说明', '**注意事项**: 说明',
+	'```', '```http', '```json', '```python', '{"k": 1}', 'GET /api',
+	'┌──┐', '│ a │', '└──┘', 'CTR = (点击 / 展示) × 100%',
+	'', '', '',
+]
+
+
+def random_doc(rng: random.Random) -> str:
+	return '\n'.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 80)))
+
+
+def assert_parity(doc: str) -> None:
+	assert toc._preprocess_chunked(doc, chunk_size=0) == toc.preprocess_markdown(doc)
+
+
+@pytest.mark.parametrize('doc', FIXED_DOCS)
+def test_fixed_docs(doc):
+	assert_parity(doc)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_random_docs(seed):
+	assert_parity(random_doc(random.Random(seed)))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""图片路径解析：只改写代码之外的本地图片引用"""
+
+import pytest
+
+import final_clickable_toc as toc
+
+BASE = '/tmp/docs'
+
+
+def test_resolves_local_images():
+	content = '正文 ![logo](img/logo.png) 与 ![远程](https://example.com/a.png)'
+	assert toc.resolve_image_paths(content, BASE) == \
+		'正文 ![logo](/tmp/docs/img/logo.png) 与 ![远程](https://example.com/a.png)'
+
+
+def test_wraps_paths_with_spaces():
+	assert toc.resolve_image_paths('![图](a.png)', '/tmp/my docs') == '![图](</tmp/my docs/a.png>)'
+
+
+@pytest.mark.parametrize('content', [
+	'示例 `![logo](img/logo.png)` 写法',
+	'示例 ``![logo](img/`x`.png)`` 写法',
+	'```markdown\n![logo](img/logo.png)\n```',
+	'~~~\n![logo](img/logo.png)\n~~~',
+	'````\n```\n![logo](img/logo.png)\n```\n````',
+	'段落\n\n    ![logo](img/logo.png)\n',
+	'~~~\n未闭合 ![logo](img/logo.png)',
+])
+def test_leaves_code_alone(content):
+	assert toc.resolve_image_paths(content, BASE) == content
+	assert toc.image_references(content) == []
+
+
+def test_resolves_after_code():
+	content = '~~~\n![a](a.png)\n~~~\n\n`![b](b.png)` ![c](c.png)\n\n- 列表\n\n    ![d](d.png)'
+	assert toc.resolve_image_paths(content, BASE) == \
+		'~~~\n![a](a.png)\n~~~\n\n`![b](b.png)` ![c](/tmp/docs/c.png)\n\n- 列表\n\n    ![d](/tmp/docs/d.png)'
+	assert toc.image_references(content) == ['c.png', 'd.png']
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""指标的 Prometheus 文本格式"""
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+	monkeypatch.setattr(metrics, '_values', {name: {} for name in metrics.METRICS})
+	monkeypatch.setattr(metrics, '_histograms', {})
+
+
+def test_large_counter_is_exact():
+	metrics.inc('md2pdf_input_bytes_total', 12345678)
+	metrics.inc('md2pdf_input_bytes_total', 1)
+	assert 'md2pdf_input_bytes_total 12345679\n' in metrics.render()
+
+
+def test_float_values_keep_all_digits():
+	metrics.set_gauge('md2pdf_queue_depth', 2.5)
+	metrics.observe('pandoc', 0.123456789)
+	text = metrics.render()
+	assert 'md2pdf_queue_depth 2.5\n' in text
+	assert 'md2pdf_stage_duration_seconds_sum{stage="pandoc"} 0.123456789\n' in text
+	assert 'md2pdf_stage_duration_seconds_count{stage="pandoc"} 1\n' in text
+
+
+def test_labelled_counter():
+	metrics.inc('md2pdf_documents_failed_total', reason='xelatex')
+	assert 'md2pdf_documents_failed_total{reason="xelatex"} 1\n' in metrics.render()
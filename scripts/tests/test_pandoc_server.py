@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""pandoc server 与 pandoc 命令行生成的 .tex 逐字节一致"""
+
+import shutil
+
+import pytest
+
+import final_clickable_toc as toc
+from toolchain import probe_toolchain
+
+SAMPLE = """# 评分体系 & 设计
+
+## 1. 概述
+第一行 `code`
+**功能描述**：说明
+
+- a
+- b
+
+| 列 | 值 |
+|:--:|---:|
+| x | 1 |
+
+```json
+{"k": 1}
+```
+
+见 [链接](https://example.com)。
+"""
+
+pytestmark = pytest.mark.skipif(
+	not shutil.which('pandoc') or not probe_toolchain()['features']['pandoc_server'],
+	reason='需要 pandoc 3（server 子命令）或 pandoc-server')
+
+
+@pytest.mark.parametrize('draft', [False, True])
+def test_server_matches_command_line(tmp_path, draft):
+	content = toc.split_oversized_blocks(toc.preprocess_markdown(SAMPLE))
+	source = tmp_path / 'temp_processed.md'
+	source.write_text(content, encoding='utf-8')
+	header = toc.pdf_header(toc.detect_features(content), draft)
+	doc_title = toc.extract_title_from_markdown(SAMPLE)
+	outputs = []
+	for use_server in (False, True):
+		tex_path = tmp_path / f'server_{use_server}.tex'
+		res = toc.markdown_to_latex(str(source), str(tex_path), header, doc_title, str(tmp_path),
+		                            draft=draft, use_server=use_server)
+		assert res.returncode == 0, res.stderr
+		outputs.append(tex_path.read_bytes())
+	assert outputs[0] == outputs[1]
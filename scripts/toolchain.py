@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具链探测缓存
+- 记录 pandoc / xelatex 等二进制的路径、版本与可用引擎
+- 结果缓存在状态文件中，以二进制路径 + mtime 判断是否失效，避免每次运行都执行 --version
+- toolchain_fingerprint() 供输出缓存（manifest 依赖）使用，保证与探测结果一致
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, Optional
+
+import metrics
+
+# 需要探测的二进制；引擎用于判断可选的 PDF 引擎
+REQUIRED_BINARIES = ('pandoc', 'xelatex')
+OPTIONAL_BINARIES = ('lualatex', 'pdflatex', 'pandoc-server', 'fc-match', 'pdfannotextractor')
+
+CACHE_VERSION = 2
+
+
+def cache_file() -> Path:
+	"""状态文件路径：$XDG_CACHE_HOME/md2pdf/toolchain.json"""
+	base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return Path(base) / 'md2pdf' / 'toolchain.json'
+
+
+def _stamp(bin_: str) -> Optional[dict]:
+	"""二进制的路径与 mtime（解析符号链接，升级后 mtime 会变化）；不存在返回 None"""
+	path = shutil.which(bin_)
+	if path is None:
+		return None
+	real = os.path.realpath(path)
+	return {'path': real, 'mtime': os.stat(real).st_mtime}
+
+
+def _version(path: str) -> Optional[str]:
+	try:
+		res = subprocess.run([path, '--version'], capture_output=True, text=True, check=True)
+	except Exception:
+		return None
+	return res.stdout.split('\n', 1)[0].strip()
+
+
+def _probe(stamps: Dict[str, Optional[dict]]) -> dict:
+	"""实际执行探测（慢路径）"""
+	tools = {}
+	for bin_, stamp in stamps.items():
+		if stamp is None:
+			tools[bin_] = None
+			continue
+		version = _version(stamp['path']) if bin_ in REQUIRED_BINARIES else None
+		tools[bin_] = {**stamp, 'version': version}
+	engines = [bin_ for bin_ in ('xelatex', 'lualatex', 'pdflatex') if tools.get(bin_)]
+	pandoc_version = (tools.get('pandoc') or {}).get('version') or ''
+	major = pandoc_version.split()[-1].split('.')[0] if pandoc_version else ''
+	return {
+		'tools': tools,
+		'engines': engines,
+		'features': {
+			# pandoc 3 起内置 server 子命令
+			'pandoc_server': bool(tools.get('pandoc-server')) or (major.isdigit() and int(major) >= 3),
+			'fc_match': bool(tools.get('fc-match')),
+			# pax 宏包配套的链接提取工具（书籍模式保留章节内链接）
+			'pdfannotextractor': bool(tools.get('pdfannotextractor')),
+		},
+	}
+
+
+def probe_toolchain(refresh: bool = False) -> dict:
+	"""返回工具链信息；二进制路径与 mtime 未变时直接读取缓存"""
+	stamps = {bin_: _stamp(bin_) for bin_ in REQUIRED_BINARIES + OPTIONAL_BINARIES}
+	path = cache_file()
+	if not refresh and path.exists():
+		try:
+			with open(path, 'r', encoding='utf-8') as f:
+				cached = json.load(f)
+			if cached.get('version') == CACHE_VERSION and cached.get('stamps') == stamps:
+				metrics.inc('md2pdf_cache_requests_total', cache='toolchain', result='hit')
+				return cached['probe']
+		except (OSError, ValueError):
+			pass
+
+	metrics.inc('md2pdf_cache_requests_total', cache='toolchain', result='miss')
+	probe = _probe(stamps)
+	try:
+		path.parent.mkdir(parents=True, exist_ok=True)
+		tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+		with open(tmp, 'w', encoding='utf-8') as f:
+			json.dump({'version': CACHE_VERSION, 'stamps': stamps, 'probe': probe}, f, ensure_ascii=False, indent=2)
+		os.replace(tmp, path)
+	except OSError:
+		pass  # 缓存不可写时不影响转换
+	return probe
+
+
+def missing_binaries(probe: dict) -> list:
+	"""必需但缺失的二进制（或无法获取版本的）"""
+	return [bin_ for bin_ in REQUIRED_BINARIES
+	        if not probe['tools'].get(bin_) or not probe['tools'][bin_].get('version')]
+
+
+def toolchain_fingerprint(probe: dict) -> str:
+	"""工具链指纹：路径 + 版本 + 引擎，作为输出缓存键的一部分"""
+	key = {
+		bin_: {'path': tool['path'], 'version': tool.get('version')} if tool else None
+		for bin_, tool in probe['tools'].items()
+	}
+	key['engines'] = probe['engines']
+	return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()